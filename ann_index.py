@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+
+from vector_search import top_k
+
+# Rows scored per block when assigning vectors to centroids, bounds peak memory
+_ASSIGN_BLOCK = 65536
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row of matrix"""
+    labels = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], _ASSIGN_BLOCK):
+        block = np.asarray(matrix[start:start + _ASSIGN_BLOCK])
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def _spherical_kmeans(sample: np.ndarray, nlist: int, iterations: int, seed: int) -> np.ndarray:
+    """Cosine k-means over normalized rows, returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Re-seed empty clusters so every list stays useful
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            norms[empty] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def resolve_nlist(nlist: int, n: int) -> int:
+    """Number of inverted lists built for n vectors (nlist=0 picks 4*sqrt(N))"""
+    if nlist <= 0:
+        nlist = int(4 * np.sqrt(n))
+    return max(1, min(nlist, n))
+
+
+class IVFIndex:
+    """Inverted-file (IVF-flat) index over an L2-normalized embedding matrix.
+
+    Vectors are clustered with spherical k-means; a query scores only the
+    rows in its `nprobe` closest clusters. The index stores row ids, not
+    vectors, and always scores against the full-precision matrix.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, fingerprint: str):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.fingerprint = fingerprint
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, fingerprint: str, nlist: int = 0,
+              iterations: int = 10, max_train: int = 100000, seed: int = 0):
+        """Cluster the matrix into nlist inverted lists (nlist=0 picks 4*sqrt(N))"""
+        n = matrix.shape[0]
+        nlist = resolve_nlist(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        if n > max_train:
+            sample = np.asarray(matrix[np.sort(rng.choice(n, max_train, replace=False))])
+        else:
+            sample = np.asarray(matrix)
+        centroids = _spherical_kmeans(sample, nlist, iterations, seed)
+
+        labels = _assign(matrix, centroids)
+        ids = np.argsort(labels, kind="stable").astype(np.int64)
+        counts = np.bincount(labels, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, offsets, ids, fingerprint)
+
+    def save(self, path: str):
+        """Write the index atomically"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, ids=self.ids,
+                     fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load an index written by save(), or None if missing or unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(data["centroids"], data["offsets"], data["ids"], str(data["fingerprint"]))
+        except (ValueError, KeyError, OSError):
+            print(f"Ignoring unreadable index file: {path}")
+            return None
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int, nprobe: int = 16):
+        """Approximate cosine top-k, returns (indices, scores) like vector_search.top_k"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        lists, _ = top_k(self.centroids, query, nprobe)
+        candidates = np.concatenate([self.ids[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        candidates.sort()
+        local, scores = top_k(matrix[candidates], query, k)
+        return candidates[local], scores
+
+
+def use_ann(config, n: int) -> bool:
+    """Whether config selects the ANN index for a vault of n vectors"""
+    index_config = config.get("index", {})
+    return index_config.get("type", "exact") == "ivf" and n >= index_config.get("min_vectors", 0)
+
+
+def build_index(config, matrix: np.ndarray, fingerprint: str):
+    """Build and save the configured index for matrix, or return None for exact search"""
+    if not use_ann(config, matrix.shape[0]):
+        return None
+    index_config = config["index"]
+    print(f"Building IVF index over {matrix.shape[0]} vectors...")
+    index = IVFIndex.build(matrix, fingerprint, nlist=index_config.get("nlist", 0))
+    index.save(index_config["file"])
+    return index
+
+
+def load_or_build_index(config, matrix: np.ndarray, fingerprint: str):
+    """Return the saved index if it matches the matrix fingerprint and nlist, rebuilding it if stale"""
+    if not use_ann(config, matrix.shape[0]):
+        return None
+    index = IVFIndex.load(config["index"]["file"])
+    nlist = resolve_nlist(config["index"].get("nlist", 0), matrix.shape[0])
+    if index is not None and index.fingerprint == fingerprint and index.nlist == nlist:
+        return index
+    return build_index(config, matrix, fingerprint)
+
+
+def search(config, matrix: np.ndarray, query: np.ndarray, k: int, index=None, quantized=None):
+    """Top-k through the ANN index or the quantized codes when available, exact search otherwise"""
+    if index is not None:
+        return index.search(matrix, query, k, nprobe=config["index"].get("nprobe", 16))
+    if quantized is not None:
+        quantization = config.get("quantization", {})
+        return quantized.search(query, k, matrix if quantization.get("rescore", True) else None,
+                                quantization.get("rescore_candidates", 100))
+    return top_k(matrix, query, k)
@@ -0,0 +1,88 @@
+import asyncio
+
+import httpx
+import ollama
+
+from embedding_client import lacks_embed_endpoint, split_batches
+
+
+class AsyncOllamaClient:
+    """Shared asyncio Ollama client for the request path.
+
+    One ollama.AsyncClient keeps a single keep-alive connection pool.
+    Embedding and generation calls are limited by separate semaphores, so a
+    burst of requests cannot flood the Ollama server and a slow generation
+    never holds up query embeddings.
+    """
+
+    def __init__(self, embedding_model: str, chat_model: str, host: str = None,
+                 max_connections: int = 16, embed_concurrency: int = 8,
+                 generate_concurrency: int = 2, batch_size: int = 64, timeout: float = 120,
+                 keep_alive=None):
+        self.embedding_model = embedding_model
+        self.chat_model = chat_model
+        # How long Ollama keeps the models loaded after a request; None uses the server default
+        self.keep_alive = keep_alive
+        self.batch_size = max(1, batch_size)
+        self.client = ollama.AsyncClient(
+            host=host,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.embed_semaphore = asyncio.Semaphore(max(1, embed_concurrency))
+        self.generate_semaphore = asyncio.Semaphore(max(1, generate_concurrency))
+        self._supports_embed = True
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a client from config.yaml's model, ollama_api and embedding sections"""
+        api_config = config.get("ollama_api", {})
+        return cls(
+            config["model"]["embedding_model"],
+            config["ollama_model"],
+            host=api_config.get("host"),
+            max_connections=api_config.get("max_connections", 16),
+            embed_concurrency=api_config.get("embed_concurrency", 8),
+            generate_concurrency=api_config.get("generate_concurrency", 2),
+            batch_size=config.get("embedding", {}).get("batch_size", 64),
+            timeout=api_config.get("timeout", 120),
+            keep_alive=api_config.get("keep_alive"),
+        )
+
+    async def _embed_batch(self, texts: list[str], model: str) -> list[list[float]]:
+        async with self.embed_semaphore:
+            if self._supports_embed:
+                try:
+                    response = await self.client.embed(model=model, input=texts, keep_alive=self.keep_alive)
+                    return list(response["embeddings"])
+                except ollama.ResponseError as e:
+                    if not lacks_embed_endpoint(e):
+                        raise
+                    self._supports_embed = False
+            return [(await self.client.embeddings(model=model, prompt=text, keep_alive=self.keep_alive))["embedding"]
+                    for text in texts]
+
+    async def embed(self, texts: list[str], model: str = None) -> list[list[float]]:
+        """Embed texts in order, running batches concurrently up to the embedding limit"""
+        model = model or self.embedding_model
+        results = await asyncio.gather(*(self._embed_batch(batch, model)
+                                         for batch in split_batches(texts, self.batch_size)))
+        return [vector for batch in results for vector in batch]
+
+    async def embed_one(self, text: str, model: str = None) -> list[float]:
+        return (await self._embed_batch([text], model or self.embedding_model))[0]
+
+    async def chat(self, messages: list[dict], options: dict = None, model: str = None, **kwargs):
+        """Complete a chat, waiting for a generation slot first"""
+        async with self.generate_semaphore:
+            return await self.client.chat(model=model or self.chat_model, messages=messages,
+                                          options=options, keep_alive=self.keep_alive, **kwargs)
+
+    async def chat_stream(self, messages: list[dict], options: dict = None, model: str = None, **kwargs):
+        """Yield chat response parts as they are generated, holding a generation slot throughout"""
+        async with self.generate_semaphore:
+            stream = await self.client.chat(model=model or self.chat_model, messages=messages,
+                                            options=options, stream=True, keep_alive=self.keep_alive,
+                                            **kwargs)
+            async for part in stream:
+                yield part
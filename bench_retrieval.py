@@ -0,0 +1,129 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embedding_store import normalize_rows
+from projection import Projection
+from quantization import QuantizedVectors
+from vector_search import top_k
+
+
+def synthetic_embeddings(n, dim, seed=0):
+    """Clustered unit vectors, closer to real embedding neighbourhoods than uniform noise"""
+    rng = np.random.default_rng(seed)
+    clusters = max(1, int(np.sqrt(n)))
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    matrix = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 65536):
+        block = labels[start:start + 65536]
+        matrix[start:start + len(block)] = centers[block] + rng.standard_normal((len(block), dim), dtype=np.float32)
+    return normalize_rows(matrix)
+
+
+def make_queries(matrix, count, noise, seed=0):
+    """Perturbed copies of random rows, standing in for queries near stored chunks"""
+    rng = np.random.default_rng(seed + 1)
+    # Small vaults are sampled with replacement; the noise still makes every query distinct
+    rows = np.asarray(matrix[np.sort(rng.choice(matrix.shape[0], count, replace=count > matrix.shape[0]))])
+    scale = noise / np.sqrt(matrix.shape[1])
+    return normalize_rows(rows + scale * rng.standard_normal(rows.shape, dtype=np.float32))
+
+
+def recall_at_k(found, truth):
+    """Mean fraction of the exact top-k found by an approximate search"""
+    return float(np.mean([len(set(f[:len(t)]) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def measure(name, search_fn, queries, truth, memory_bytes, baseline_bytes):
+    start = time.perf_counter()
+    found = [search_fn(query)[0] for query in queries]
+    elapsed = time.perf_counter() - start
+    return {
+        "method": name,
+        "recall": round(recall_at_k(found, truth), 4),
+        "ms_per_query": round(elapsed / len(queries) * 1000, 3),
+        "memory_mb": round(memory_bytes / 2**20, 2),
+        "compression": round(baseline_bytes / memory_bytes, 1),
+    }
+
+
+def run(args):
+    if args.embeddings:
+        matrix = np.load(args.embeddings, mmap_mode="r")
+    else:
+        matrix = synthetic_embeddings(args.synthetic, args.dim, args.seed)
+    queries = make_queries(matrix, args.queries, args.noise, args.seed)
+    k = args.k
+    print(f"{matrix.shape[0]} vectors x {matrix.shape[1]} dims, {len(queries)} queries, recall@{k}")
+
+    # Ground truth: exact float32 search
+    truth = [top_k(matrix, query, k)[0] for query in queries]
+    baseline_bytes = matrix.shape[0] * matrix.shape[1] * 4
+    results = [measure("float32", lambda q: top_k(matrix, q, k), queries, truth, baseline_bytes, baseline_bytes)]
+
+    for kind in ("int8", "binary"):
+        quantized = QuantizedVectors.build(matrix, kind)
+        results.append(measure(kind, lambda q: quantized.search(q, k), queries, truth,
+                               quantized.nbytes, baseline_bytes))
+        for candidates in args.rescore_candidates:
+            # Rescoring touches only the candidate rows of the float matrix, which stays on disk
+            results.append(measure(f"{kind}+rescore@{candidates}",
+                                   lambda q: quantized.search(q, k, matrix, candidates),
+                                   queries, truth, quantized.nbytes, baseline_bytes))
+
+    # Recall of reduced-dimension vectors against the full-dimension ground truth
+    for kind in args.projections:
+        for dim in args.dims:
+            if dim >= matrix.shape[1]:
+                continue
+            projection = Projection.fit(matrix, kind, dim)
+            projected = projection.apply(matrix)
+            projected_queries = projection.apply(queries)
+            results.append(measure(f"{kind}-{dim}", lambda q: top_k(projected, q, k), projected_queries,
+                                   truth, projected.nbytes, baseline_bytes))
+    return {
+        "vectors": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "queries": len(queries),
+        "k": k,
+        "results": results,
+    }
+
+
+def print_table(report):
+    print(f"{'method':<24}{'recall':>8}{'ms/query':>10}{'memory MB':>11}{'x smaller':>11}")
+    for row in report["results"]:
+        print(f"{row['method']:<24}{row['recall']:>8.4f}{row['ms_per_query']:>10.3f}"
+              f"{row['memory_mb']:>11.2f}{row['compression']:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, speed and memory of the vector search options")
+    parser.add_argument("--embeddings", help="normalized float32 .npy matrix (e.g. vault_embeddings.npy)")
+    parser.add_argument("--synthetic", type=int, default=100000, help="synthetic vectors when no --embeddings")
+    parser.add_argument("--dim", type=int, default=1024, help="synthetic vector dimension")
+    parser.add_argument("--queries", type=int, default=200, help="queries to run")
+    parser.add_argument("--noise", type=float, default=0.5, help="query distance from the sampled rows")
+    parser.add_argument("--k", type=int, default=10, help="recall@k")
+    parser.add_argument("--rescore-candidates", type=int, nargs="+", default=[50, 100, 200],
+                        help="candidate counts to rescore with float vectors")
+    parser.add_argument("--dims", type=int, nargs="*", default=[],
+                        help="reduced dimensions to compare with the full dimension, e.g. 64 128 256 512")
+    parser.add_argument("--projections", nargs="+", default=["pca", "truncate"], choices=Projection.KINDS,
+                        help="projections to fit for --dims (truncate only suits Matryoshka-trained models)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_table(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,18 +10,28 @@ async def chat():
             if query.lower() in ['salir', 'exit']:
                 break
                 
-            # Send the query directly in JSON format
+            # Send the query directly in JSON format, asking for a streamed answer
             await websocket.send(json.dumps({
                 "type": "message",
-                "content": query
+                "content": query,
+                "stream": True
             }))
             
             # Get responses until we receive the final answer
+            streamed = False
             while True:
                 response = await websocket.recv()
                 try:
                     result = json.loads(response)
                     
+                    # Render streamed tokens as they arrive
+                    if result.get('type') == 'token':
+                        if not streamed:
+                            print('\nDr. Simi: ', end='', flush=True)
+                            streamed = True
+                        print(result['data']['token'], end='', flush=True)
+                        continue
+                    
                     # Handle thinking messages
                     if result.get('type') == 'thinking':
                         # Clear the current line and print thinking message
@@ -30,7 +40,8 @@ async def chat():
                         continue
                     
                     # Clear the thinking message line
-                    print('\r' + ' ' * 50 + '\r', end='', flush=True)
+                    if not streamed:
+                        print('\r' + ' ' * 50 + '\r', end='', flush=True)
                     
                     # Handle the final response
                     if result.get('type') == 'answer' and 'data' in result:
@@ -42,7 +53,10 @@ async def chat():
                             except json.JSONDecodeError:
                                 data = {'answer': data}
                         
-                        if isinstance(data, dict) and 'answer' in data:
+                        if streamed:
+                            # The answer was already printed token by token
+                            print()
+                        elif isinstance(data, dict) and 'answer' in data:
                             print('\nDr. Simi:', data['answer'].strip())
                         else:
                             print('\nDr. Simi:', str(data).strip())
@@ -50,6 +64,10 @@ async def chat():
                     elif result.get('type') == 'error':
                         print('\nError:', result['data']['message'])
                         break
+                    elif result.get('type') == 'busy':
+                        print('\nServidor ocupado, intenta de nuevo en',
+                              result['data']['estimated_wait_s'], 'segundos')
+                        break
                     else:
                         print('\nResponse:', result)
                         break
@@ -0,0 +1,105 @@
+import math
+
+import numpy as np
+
+
+def estimate_tokens(text: str, chars_per_token: float = 3.5) -> int:
+    """Rough token count without a tokenizer; Spanish text runs about 3.5 characters per token"""
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def estimate_token_counts(chunks, chars_per_token: float = 3.5) -> np.ndarray:
+    """Token estimates for every chunk, computed once when the vault is ingested"""
+    return np.array([estimate_tokens(chunk, chars_per_token) for chunk in chunks], dtype=np.int32)
+
+
+class ContextPacker:
+    """Fits retrieved chunks into a fixed prompt token budget.
+
+    Chunks are taken in score order. Near-duplicates of an already packed
+    chunk are dropped, a chunk that does not fit is trimmed at a word
+    boundary if at least `min_chunk_tokens` of it fit, and everything
+    ranked lower is dropped once the budget is spent.
+    """
+
+    def __init__(self, budget_tokens: int = 1024, chars_per_token: float = 3.5,
+                 min_chunk_tokens: int = 32, redundancy_threshold: float = 0.95):
+        self.budget_tokens = budget_tokens
+        self.chars_per_token = chars_per_token
+        self.min_chunk_tokens = min_chunk_tokens
+        self.redundancy_threshold = redundancy_threshold
+
+    @classmethod
+    def from_config(cls, context_config):
+        context_config = context_config or {}
+        return cls(
+            context_config.get("budget_tokens", 1024),
+            context_config.get("chars_per_token", 3.5),
+            context_config.get("min_chunk_tokens", 32),
+            context_config.get("redundancy_threshold", 0.95),
+        )
+
+    def estimate(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+
+    def _trim(self, text: str, tokens: int) -> str:
+        """Cut text to about `tokens` tokens, at the last whole word"""
+        cut = text[:int(tokens * self.chars_per_token)]
+        if len(cut) < len(text) and " " in cut:
+            cut = cut.rsplit(" ", 1)[0]
+        return cut
+
+    def pack(self, chunks, token_counts=None, vectors=None, budget: int = None):
+        """Select chunks in the given (score) order until the budget is spent.
+
+        token_counts are the chunks' cached estimates, computed here if
+        missing. vectors are the chunks' normalized embeddings, used to drop
+        near-duplicates; without them only identical texts are dropped.
+        Returns (texts, kept, tokens): the packed texts, the positions of
+        the chunks they came from and the estimated tokens used.
+        """
+        if budget is None:
+            budget = self.budget_tokens
+        remaining = budget
+        texts, kept, kept_vectors, seen = [], [], [], set()
+        for i, chunk in enumerate(chunks):
+            if remaining <= 0:
+                break
+            if chunk in seen:
+                continue
+            if vectors is not None:
+                vector = np.asarray(vectors[i], dtype=np.float32)
+                if kept_vectors and float(np.max(np.stack(kept_vectors) @ vector)) >= self.redundancy_threshold:
+                    continue
+            tokens = int(token_counts[i]) if token_counts is not None else self.estimate(chunk)
+            if tokens > remaining:
+                if remaining < self.min_chunk_tokens:
+                    # Lower-ranked chunks are dropped rather than squeezed in as fragments
+                    break
+                chunk = self._trim(chunk, remaining)
+                tokens = self.estimate(chunk)
+            texts.append(chunk)
+            kept.append(i)
+            seen.add(chunks[i])
+            if vectors is not None:
+                kept_vectors.append(vector)
+            remaining -= tokens
+        return texts, kept, budget - remaining
+
+    def pack_history(self, messages, budget: int = None):
+        """Keep the most recent whole messages that fit the budget.
+
+        Returns (messages, tokens): the kept messages, oldest first, and the
+        estimated tokens they use.
+        """
+        if budget is None:
+            budget = self.budget_tokens
+        kept, used = [], 0
+        for message in reversed(messages):
+            tokens = self.estimate(message["content"])
+            if used + tokens > budget:
+                # Older turns are dropped together so the conversation stays contiguous
+                break
+            kept.append(message)
+            used += tokens
+        return kept[::-1], used
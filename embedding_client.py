@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import ollama
+
+
+def split_batches(texts: list[str], batch_size: int) -> list[list[str]]:
+    return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+
+def lacks_embed_endpoint(error: ollama.ResponseError) -> bool:
+    """Whether an /api/embed failure means the server predates the multi-input endpoint.
+
+    Such servers answer 404 for the route itself; a 404 about the model not
+    being pulled is an error for the caller, not a reason to fall back.
+    """
+    return error.status_code == 404 and "model" not in str(error.error).lower()
+
+
+class EmbeddingClient:
+    """Batched, concurrent Ollama embedding client.
+
+    Texts are split into batches of `batch_size` and sent through Ollama's
+    multi-input /api/embed endpoint, up to `concurrency` batches at a time
+    over one pooled HTTP connection. Servers without /api/embed fall back
+    to one /api/embeddings call per text.
+    """
+
+    def __init__(self, model: str, host: str = None, batch_size: int = 64, concurrency: int = 4):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.client = ollama.Client(host=host)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="embed")
+        self._supports_embed = True
+
+    @classmethod
+    def from_config(cls, config, model: str = None):
+        """Build a client from config.yaml's ollama_api and embedding sections"""
+        embedding_config = config.get("embedding", {})
+        return cls(
+            model or config["model"]["embedding_model"],
+            host=config.get("ollama_api", {}).get("host"),
+            batch_size=embedding_config.get("batch_size", 64),
+            concurrency=embedding_config.get("concurrency", 4),
+        )
+
+    def _embed_batch(self, texts: list[str], model: str) -> list[list[float]]:
+        if self._supports_embed:
+            try:
+                return list(self.client.embed(model=model, input=texts)["embeddings"])
+            except ollama.ResponseError as e:
+                if not lacks_embed_endpoint(e):
+                    raise
+                self._supports_embed = False
+        return [self.client.embeddings(model=model, prompt=text)["embedding"] for text in texts]
+
+    def embed(self, texts: list[str], model: str = None) -> list[list[float]]:
+        """Embed texts in order, batching and running batches concurrently"""
+        model = model or self.model
+        batches = split_batches(texts, self.batch_size)
+        if len(batches) <= 1:
+            return self._embed_batch(texts, model) if texts else []
+        results = self._executor.map(lambda batch: self._embed_batch(batch, model), batches)
+        return [vector for batch in results for vector in batch]
+
+    def embed_one(self, text: str, model: str = None) -> list[float]:
+        """Embed a single text"""
+        return self._embed_batch([text], model or self.model)[0]
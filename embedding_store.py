@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def chunk_key(text: str, model: str) -> str:
+    """Content address of a chunk: hash of the embedding model and the chunk text"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def keys_fingerprint(keys: list[str]) -> str:
+    """Single hash identifying an ordered list of chunk keys"""
+    return hashlib.sha256("".join(keys).encode("ascii")).hexdigest()
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Return vectors as a contiguous float32 array with unit L2 norm per row"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+@contextmanager
+def _replacing(path: str, mode: str, **kwargs):
+    """Open a uniquely named temporary file that replaces path once written.
+
+    Unique names keep processes saving the same store at once from writing
+    into each other's temporary file.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class EmbeddingStore:
+    """Persistent embedding matrix for vault chunks.
+
+    Row i of the .npy file at `path` is the L2-normalized float32 embedding of
+    the chunk whose chunk_key() is entry i of the sidecar `.keys.json` file.
+    The matrix is memory-mapped read-only, so startup does not read it and
+    several processes share the same page-cache pages. Editing a chunk or
+    switching model.embedding_model changes its key, so only those rows are
+    re-embedded on the next rebuild.
+    """
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.keys_path = os.path.splitext(path)[0] + ".keys.json"
+        self.model = model
+        # Mapped on first use, so processes that never rebuild the matrix never map it
+        self.keys = None
+        self.matrix = None
+        self.fingerprint = None
+
+    def _load(self):
+        """Memory-map the matrix and its keys, starting empty if missing or inconsistent"""
+        self.keys, self.matrix = [], None
+        self.fingerprint = keys_fingerprint([])
+        if not (os.path.exists(self.path) and os.path.exists(self.keys_path)):
+            return
+        try:
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = json.load(f)["keys"]
+            matrix = np.load(self.path, mmap_mode="r")
+        except (ValueError, KeyError, OSError):
+            print(f"Ignoring unreadable embeddings file: {self.path}")
+            return
+        if matrix.ndim != 2 or matrix.shape[0] != len(keys) or matrix.dtype != np.float32:
+            print(f"Ignoring inconsistent embeddings file: {self.path}")
+            return
+        self.keys, self.matrix = keys, matrix
+        self.fingerprint = keys_fingerprint(keys)
+
+    def _save(self, keys: list[str], matrix: np.ndarray):
+        """Write matrix and keys atomically, then re-map the new matrix"""
+        # Remove the keys first so a crash mid-save can never pair old keys with new rows
+        if os.path.exists(self.keys_path):
+            os.remove(self.keys_path)
+        # Release our mapping before replacing the file (required on Windows)
+        self.matrix = None
+
+        with _replacing(self.path, "wb") as f:
+            np.save(f, matrix)
+        with _replacing(self.keys_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "keys": keys}, f)
+
+        self._load()
+
+    def get_matrix(self, chunks: list[str], embed_fn) -> np.ndarray:
+        """Return the normalized embedding matrix for chunks.
+
+        embed_fn takes a list of texts and returns their embeddings; it is
+        called once, with only the chunks missing from the store.
+        """
+        if self.keys is None:
+            self._load()
+        keys = [chunk_key(chunk, self.model) for chunk in chunks]
+        if keys == self.keys and self.matrix is not None:
+            return self.matrix
+
+        if not chunks:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # Reuse rows of chunks that are still in the vault, embed the rest
+        old_rows = {key: row for row, key in enumerate(self.keys)}
+        missing = [i for i, key in enumerate(keys) if key not in old_rows]
+        new_vectors = normalize_rows(embed_fn([chunks[i] for i in missing])) if missing else None
+
+        dim = new_vectors.shape[1] if new_vectors is not None else self.matrix.shape[1]
+        matrix = np.empty((len(keys), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in old_rows:
+                matrix[i] = self.matrix[old_rows[key]]
+        if missing:
+            matrix[missing] = new_vectors
+
+        self._save(keys, matrix)
+        return self.matrix
@@ -0,0 +1,237 @@
+"""Deterministic stand-in for an Ollama server, for benchmarks and offline tests.
+
+Implements /api/embeddings, /api/embed, /api/chat and the OpenAI-compatible
+/v1/chat/completions. Embeddings are feature-hashed from the text's tokens,
+so equal texts get equal vectors and texts sharing words get similar ones.
+Completions are scripted and streamed at a fixed rate, so measurements show
+the pipeline's own overhead instead of model noise.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from text.spanish import tokenize_spanish
+
+DEFAULT_RESPONSES = [
+    "Claro, con gusto te ayudo con eso.",
+    "La Fundación BEST ofrece servicios de salud a comunidades que lo necesitan.",
+    "Puedes encontrarnos en muchas ciudades de México.",
+    "Ese programa apoya a personas y familias con atención médica.",
+    "Si tienes otra duda, aquí estoy para platicarlo.",
+]
+
+
+class FakeOllamaSettings:
+    def __init__(self, dim=1024, embed_latency_ms=0.0, first_token_ms=0.0,
+                 tokens_per_second=0.0, response_tokens=0, responses=None):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.responses = responses or DEFAULT_RESPONSES
+
+
+settings = FakeOllamaSettings()
+app = FastAPI(title="Fake Ollama")
+
+
+@lru_cache(maxsize=65536)
+def _token_vector(token: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    """Deterministic unit vector: normalized sum of per-token hashed Gaussian vectors"""
+    tokens = tokenize_spanish(text) or [text]
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokens:
+        vector += _token_vector(token, dim)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def scripted_tokens(messages: list[dict]) -> list[str]:
+    """Pick a canned response from the last user message, split into word tokens"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    words = settings.responses[digest[0] % len(settings.responses)].split()
+    if settings.response_tokens:
+        words = [words[i % len(words)] for i in range(settings.response_tokens)]
+    return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+
+def prompt_token_count(messages: list[dict]) -> int:
+    return sum(len(str(m.get("content", "")).split()) for m in messages)
+
+
+async def generate(messages: list[dict]):
+    """Yield scripted tokens with the configured first-token delay and rate"""
+    await asyncio.sleep(settings.first_token_ms / 1000)
+    delay = 1 / settings.tokens_per_second if settings.tokens_per_second else 0
+    for i, token in enumerate(scripted_tokens(messages)):
+        if i and delay:
+            await asyncio.sleep(delay)
+        yield token
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@app.get("/")
+async def root():
+    return PlainTextResponse("Ollama is running")
+
+
+@app.get("/api/version")
+async def version():
+    return {"version": "0.0.0-fake"}
+
+
+@app.post("/api/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    await asyncio.sleep(settings.embed_latency_ms / 1000)
+    return {"embedding": fake_embedding(body.get("prompt", ""), settings.dim)}
+
+
+@app.post("/api/embed")
+async def embed(request: Request):
+    body = await request.json()
+    inputs = body.get("input", "")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    await asyncio.sleep(settings.embed_latency_ms / 1000)
+    return {
+        "model": body.get("model", ""),
+        "embeddings": [fake_embedding(text, settings.dim) for text in inputs],
+        "prompt_eval_count": sum(len(text.split()) for text in inputs),
+    }
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    model = body.get("model", "")
+    messages = body.get("messages", [])
+    start = time.perf_counter_ns()
+
+    def final_message(content: str, eval_count: int) -> dict:
+        return {
+            "model": model,
+            "created_at": _now(),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": time.perf_counter_ns() - start,
+            "prompt_eval_count": prompt_token_count(messages),
+            "eval_count": eval_count,
+        }
+
+    if not body.get("stream", True):
+        tokens = [token async for token in generate(messages)]
+        return JSONResponse(final_message("".join(tokens), len(tokens)))
+
+    async def stream():
+        count = 0
+        async for token in generate(messages):
+            count += 1
+            yield json.dumps({
+                "model": model,
+                "created_at": _now(),
+                "message": {"role": "assistant", "content": token},
+                "done": False,
+            }) + "\n"
+        yield json.dumps(final_message("", count)) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "")
+    messages = body.get("messages", [])
+    completion_id = "chatcmpl-" + hashlib.sha256(json.dumps(messages).encode("utf-8")).hexdigest()[:12]
+    created = int(time.time())
+
+    if not body.get("stream", False):
+        tokens = [token async for token in generate(messages)]
+        prompt_tokens = prompt_token_count(messages)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            },
+        }
+
+    async def stream():
+        async for token in generate(messages):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="added latency per embedding request")
+    parser.add_argument("--first-token-ms", type=float, default=0.0, help="delay before the first generated token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="generation rate, 0 = unthrottled")
+    parser.add_argument("--response-tokens", type=int, default=0,
+                        help="tokens per completion, 0 = length of the scripted response")
+    parser.add_argument("--responses", help="file with one scripted response per line")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r", encoding="utf-8-sig") as f:
+            responses = [line.strip() for line in f if line.strip()]
+
+    global settings
+    settings = FakeOllamaSettings(args.dim, args.embed_latency_ms, args.first_token_ms,
+                                  args.tokens_per_second, args.response_tokens, responses)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
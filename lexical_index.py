@@ -0,0 +1,177 @@
+import os
+from collections import Counter
+
+import numpy as np
+
+from text.spanish import STEMMER_VERSION, tokenize_spanish
+
+
+class BM25Index:
+    """Inverted index over vault chunks with BM25 scoring.
+
+    Tokens come from text.spanish.tokenize_spanish (accent folding, stopword
+    removal, light stemming). The vocabulary is a sorted array of UTF-8
+    terms, so term t is found by binary search and every array can be
+    memory-mapped. Postings are stored CSR-style: the postings of term t are
+    doc_ids/term_freqs[offsets[t]:offsets[t + 1]].
+    """
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, fingerprint: str,
+                 k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.fingerprint = fingerprint
+        self.k1 = k1
+        self.b = b
+        n = len(doc_lengths)
+        doc_freqs = np.diff(offsets)
+        self.idf = np.log(1 + (n - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = doc_lengths.mean() if n else 1.0
+        # Per-document length normalization, precomputed once
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunks: list[str], fingerprint: str, k1: float = 1.2, b: float = 0.75):
+        postings = {}
+        doc_lengths = np.zeros(len(chunks), dtype=np.float32)
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize_spanish(chunk)
+            doc_lengths[doc_id] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, freq))
+
+        # Term ids follow the sorted vocabulary; UTF-8 byte order matches str order
+        vocabulary = sorted(postings)
+        terms = np.array([term.encode("utf-8") for term in vocabulary]) if vocabulary else np.empty(0, dtype="S1")
+        counts = np.array([len(postings[term]) for term in vocabulary], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        flat = [posting for term in vocabulary for posting in postings[term]]
+        doc_ids = np.array([d for d, _ in flat], dtype=np.int64)
+        term_freqs = np.array([f for _, f in flat], dtype=np.float32)
+        return cls(terms, offsets, doc_ids, term_freqs, doc_lengths, fingerprint, k1, b)
+
+    def arrays(self) -> dict:
+        """The index's arrays by name, as stored on disk"""
+        return {"terms": self.terms, "offsets": self.offsets, "doc_ids": self.doc_ids,
+                "term_freqs": self.term_freqs, "doc_lengths": self.doc_lengths}
+
+    def save(self, path: str):
+        """Write the index atomically"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, fingerprint=np.array(self.fingerprint), **self.arrays())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, k1: float = 1.2, b: float = 0.75):
+        """Load an index written by save(), or None if missing or unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(data["terms"], data["offsets"], data["doc_ids"],
+                           data["term_freqs"], data["doc_lengths"], str(data["fingerprint"]), k1, b)
+        except (ValueError, KeyError, OSError):
+            print(f"Ignoring unreadable lexical index file: {path}")
+            return None
+
+    def term_id(self, term: str):
+        """Row of term in the vocabulary, or None if no chunk contains it"""
+        key = term.encode("utf-8")
+        i = int(np.searchsorted(self.terms, key))
+        if i < len(self.terms) and self.terms[i] == key:
+            return i
+        return None
+
+    def scores(self, query: str):
+        """BM25 score of every chunk, plus the fraction of query terms found in the vault"""
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        terms = set(tokenize_spanish(query))
+        matched = 0
+        for term in terms:
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            matched += 1
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+        return scores, (matched / len(terms) if terms else 0.0)
+
+    def search(self, query: str, k: int):
+        """Top-k chunks by BM25, returns (indices, scores, term coverage); zero scores are dropped"""
+        scores, coverage = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), coverage
+        order = np.argpartition(-scores, k - 1)[:k]
+        order = order[np.argsort(-scores[order], kind="stable")]
+        return order, scores[order], coverage
+
+
+def reciprocal_rank_fusion(rankings: list, k: int, rrf_k: int = 60) -> np.ndarray:
+    """Fuse ranked index lists by summing 1 / (rrf_k + rank), returns the top-k indices"""
+    fused = {}
+    for ranking in rankings:
+        for rank, index in enumerate(ranking):
+            fused[int(index)] = fused.get(int(index), 0.0) + 1.0 / (rrf_k + rank + 1)
+    best = sorted(fused, key=fused.get, reverse=True)[:k]
+    return np.array(best, dtype=np.int64)
+
+
+def lexical_config(config) -> dict:
+    return config.get("retrieval", {})
+
+
+def uses_lexical(config) -> bool:
+    """Whether the configured retrieval mode needs the BM25 index"""
+    retrieval = lexical_config(config)
+    return retrieval.get("mode", "dense") != "dense" or retrieval.get("lexical_fast_path", False)
+
+
+def _tokens_fingerprint(fingerprint: str) -> str:
+    """Vault fingerprint qualified by the stemmer, so a stemmer change rebuilds the index"""
+    return f"{fingerprint}:stem{STEMMER_VERSION}"
+
+
+def build_lexical_index(config, chunks: list[str], fingerprint: str):
+    """Build and save the BM25 index for chunks, or return None when unused"""
+    if not uses_lexical(config):
+        return None
+    retrieval = lexical_config(config)
+    index = BM25Index.build(chunks, _tokens_fingerprint(fingerprint),
+                            retrieval.get("bm25_k1", 1.2), retrieval.get("bm25_b", 0.75))
+    index.save(retrieval.get("lexical_file", "vault_lexical.npz"))
+    return index
+
+
+def load_or_build_lexical_index(config, chunks: list[str], fingerprint: str):
+    """Return the saved BM25 index if it matches the vault fingerprint, rebuilding it if stale"""
+    if not uses_lexical(config):
+        return None
+    retrieval = lexical_config(config)
+    index = BM25Index.load(retrieval.get("lexical_file", "vault_lexical.npz"),
+                           retrieval.get("bm25_k1", 1.2), retrieval.get("bm25_b", 0.75))
+    if index is not None and index.fingerprint == _tokens_fingerprint(fingerprint):
+        return index
+    return build_lexical_index(config, chunks, fingerprint)
+
+
+def is_confident(config, scores: np.ndarray, coverage: float) -> bool:
+    """Whether BM25 alone is trusted to answer, so the query embedding can be skipped.
+
+    Requires every query term to occur in the vault, a top score of at least
+    fast_path_min_score and a lead over the runner-up of fast_path_margin.
+    """
+    retrieval = lexical_config(config)
+    if not retrieval.get("lexical_fast_path", False) or len(scores) == 0 or coverage < 1.0:
+        return False
+    if scores[0] < retrieval.get("fast_path_min_score", 1.5):
+        return False
+    runner_up = scores[1] if len(scores) > 1 else 0.0
+    return scores[0] >= retrieval.get("fast_path_margin", 1.5) * runner_up
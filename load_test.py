@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import websockets
+
+
+def load_queries(path):
+    """Read one query per line; JSON lines use their content/query/text/title field"""
+    queries = []
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                queries.append(line)
+                continue
+            if isinstance(data, dict):
+                for field in ('content', 'query', 'text', 'title'):
+                    if data.get(field):
+                        queries.append(str(data[field]))
+                        break
+            else:
+                queries.append(str(data))
+    if not queries:
+        raise ValueError(f"No queries found in {path}")
+    return queries
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values (0 <= p <= 100), None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(max(1, math.ceil(p / 100 * len(ordered))), len(ordered))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values), 2),
+        'p50': round(percentile(values, 50), 2),
+        'p95': round(percentile(values, 95), 2),
+        'p99': round(percentile(values, 99), 2),
+        'max': round(max(values), 2),
+    }
+
+
+async def run_query(websocket, query, stream):
+    """Send one query and wait for its final frame; returns a result record"""
+    start = time.perf_counter()
+    first_token = None
+    await websocket.send(json.dumps({
+        "type": "message",
+        "content": query,
+        "stream": stream
+    }))
+    while True:
+        result = json.loads(await websocket.recv())
+        kind = result.get('type')
+        if kind == 'thinking':
+            continue
+        if kind == 'token':
+            if first_token is None:
+                first_token = time.perf_counter()
+            continue
+        end = time.perf_counter()
+        data = result.get('data') or {}
+        return {
+            'outcome': kind,
+            'start': start,
+            'latency_ms': (end - start) * 1000,
+            'ttft_ms': ((first_token or end) - start) * 1000,
+            'cached': bool(data.get('cached')),
+            'coalesced': bool(data.get('coalesced')),
+        }
+
+
+async def session(uri, jobs, results, stream, abandon_after=None):
+    """One websocket connection answering jobs (arrival time, query) until the queue is closed.
+
+    With abandon_after (seconds), queries not answered in time are abandoned like an
+    impatient client would: the connection is closed and a new one opened.
+    """
+    websocket = await websockets.connect(uri, max_size=None)
+    try:
+        while True:
+            job = await jobs.get()
+            if job is None:
+                return
+            arrival, query = job
+            try:
+                record = await asyncio.wait_for(run_query(websocket, query, stream), abandon_after)
+            except asyncio.TimeoutError:
+                record = {'outcome': 'abandoned', 'start': time.perf_counter() - abandon_after,
+                          'latency_ms': None, 'ttft_ms': None}
+                await websocket.close()
+                websocket = await websockets.connect(uri, max_size=None)
+            except Exception as e:
+                record = {'outcome': 'exception', 'error': str(e), 'start': time.perf_counter(),
+                          'latency_ms': None, 'ttft_ms': None}
+            if arrival is not None:
+                # Open loop: count time spent waiting for a free session too
+                queued_ms = (record['start'] - arrival) * 1000
+                record['queued_ms'] = queued_ms
+                if record['latency_ms'] is not None:
+                    record['latency_ms'] += queued_ms
+                    record['ttft_ms'] += queued_ms
+            results.append(record)
+    finally:
+        await websocket.close()
+
+
+def server_stats(uri):
+    """The server's /stats, next to the websocket endpoint; None if unavailable"""
+    parts = urllib.parse.urlsplit(uri)
+    scheme = 'https' if parts.scheme == 'wss' else 'http'
+    try:
+        with urllib.request.urlopen(f"{scheme}://{parts.netloc}/stats", timeout=5) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+async def run(args):
+    queries = load_queries(args.queries)
+    rng = random.Random(args.seed)
+    jobs = asyncio.Queue()
+    results = []
+
+    abandon_after = args.abandon_after_ms / 1000 if args.abandon_after_ms else None
+    sessions = [asyncio.create_task(session(args.uri, jobs, results, args.stream, abandon_after))
+                for _ in range(args.sessions)]
+
+    def next_query(i):
+        return rng.choice(queries) if args.shuffle else queries[i % len(queries)]
+
+    start = time.perf_counter()
+    if args.rate:
+        # Open loop: Poisson arrivals at the target rate, independent of response times
+        for i in range(args.requests):
+            jobs.put_nowait((time.perf_counter(), next_query(i)))
+            await asyncio.sleep(rng.expovariate(args.rate))
+    else:
+        # Closed loop: every session sends its next query as soon as the previous one finishes
+        for i in range(args.requests):
+            jobs.put_nowait((None, next_query(i)))
+    for _ in sessions:
+        jobs.put_nowait(None)
+    await asyncio.gather(*sessions)
+    elapsed = time.perf_counter() - start
+
+    # Every client has gone; abandoned queries must not still hold scheduler slots or queue places
+    await asyncio.sleep(1)
+    stats = server_stats(args.uri)
+    scheduler = stats.get('scheduler') if stats else None
+    if scheduler and (scheduler.get('active') or scheduler.get('queued')):
+        print(f"Warning: scheduler still has {scheduler.get('active')} active and "
+              f"{scheduler.get('queued')} queued requests after all clients left")
+
+    answered = [r for r in results if r['outcome'] == 'answer']
+    outcomes = {}
+    for r in results:
+        outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'config': {
+            'uri': args.uri,
+            'queries': args.queries,
+            'sessions': args.sessions,
+            'requests': args.requests,
+            'rate': args.rate,
+            'mode': 'open' if args.rate else 'closed',
+            'stream': args.stream,
+            'abandon_after_ms': args.abandon_after_ms,
+        },
+        'duration_s': round(elapsed, 2),
+        'throughput_rps': round(len(answered) / elapsed, 2) if elapsed else 0.0,
+        'outcomes': outcomes,
+        'cached': sum(1 for r in answered if r['cached']),
+        'coalesced': sum(1 for r in answered if r['coalesced']),
+        'ttft_ms': summarize([r['ttft_ms'] for r in answered]),
+        'latency_ms': summarize([r['latency_ms'] for r in answered]),
+        'scheduler_after': scheduler,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the /airesponse websocket")
+    parser.add_argument("--uri", default="ws://localhost:8100/airesponse", help="websocket endpoint")
+    parser.add_argument("--queries", required=True, help="file with one query per line (plain text or JSON)")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent websocket sessions")
+    parser.add_argument("--requests", type=int, default=100, help="total queries to send")
+    parser.add_argument("--rate", type=float, default=0, help="target queries/s (open loop); 0 = closed loop")
+    parser.add_argument("--stream", action="store_true", help="request streamed answers")
+    parser.add_argument("--shuffle", action="store_true", help="pick queries at random instead of in order")
+    parser.add_argument("--abandon-after-ms", type=float, default=0,
+                        help="disconnect from queries not answered within this time; 0 = wait for every answer")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for arrivals and shuffling")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,3 @@
-import torch
-import ollama
 import os
 from openai import OpenAI
 import argparse
@@ -10,7 +8,14 @@ from typing import List, Dict, Any
 from datetime import datetime
 import time
 import threading
+import asyncio
 from pathlib import Path
+from collections import deque
+from embedding_client import EmbeddingClient
+from embedding_store import EmbeddingStore, normalize_rows
+from vault_snapshot import read_vault
+from vector_search import top_k as top_k_rows
+from context_packer import ContextPacker
 
 # ANSI escape codes for colors
 PINK = '\033[95m'
@@ -31,16 +36,12 @@ def open_file(filepath):
 
 # Function to get relevant context from the vault based on user input
 def get_relevant_context(rewritten_input, vault_embeddings, vault_content, top_k=3):
-    if vault_embeddings.nelement() == 0:  # Check if the tensor has any elements
+    if vault_embeddings.shape[0] == 0:  # Check if the vault has any embeddings
         return []
     # Encode the rewritten input
-    input_embedding = ollama.embeddings(model='mxbai-embed-large', prompt=rewritten_input)["embedding"]
-    # Compute cosine similarity between the input and vault embeddings
-    cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), vault_embeddings)
-    # Adjust top_k if it's greater than the number of available scores
-    top_k = min(top_k, len(cos_scores))
-    # Sort the scores and get the top-k indices
-    top_indices = torch.topk(cos_scores, k=top_k)[1].tolist()
+    input_embedding = normalize_rows(embedding_client.embed_one(rewritten_input))
+    # Cosine similarity against the normalized vault rows, best top_k first
+    top_indices, _ = top_k_rows(vault_embeddings, input_embedding, top_k)
     # Get the corresponding context from the vault
     relevant_context = [vault_content[idx].strip() for idx in top_indices]
     return relevant_context
@@ -66,113 +67,139 @@ def rewrite_query(user_input_json, conversation_history, ollama_model, config):
     rewritten_query = response.choices[0].message.content.strip()
     return json.dumps({"Rewritten Query": rewritten_query})
 
+def _message_record(message):
+    """A memory message without its cached embedding, for the journal and the chat API"""
+    return {key: value for key, value in message.items() if key != "embedding"}
+
 class MemoryManager:
-    def __init__(self, max_memory_size: int = 10, timeout_seconds: int = 60):
+    """Conversation memory: the last max_memory_size messages in an in-process ring buffer.
+
+    Every change is appended as one line to a JSONL journal, replayed at
+    startup, so a turn costs a single small append instead of rewriting and
+    re-reading the whole history. The journal is compacted to the current
+    buffer once it holds compact_every records. Idle memory expires on the
+    next access after timeout_seconds, without a polling thread.
+    """
+
+    def __init__(self, max_memory_size: int = 10, timeout_seconds: int = 60,
+                 memory_file: str = "memory.jsonl", compact_every: int = 100):
         self.max_memory_size = max_memory_size
         self.timeout_seconds = timeout_seconds
-        self.memory_file = Path("memory.json")
+        self.memory_file = Path(memory_file)
+        self.compact_every = max(compact_every, max_memory_size)
+        self.conversations = deque(maxlen=max_memory_size)
         self.last_activity = time.time()
         self.goodbye_phrases = [
             'adios', 'hasta pronto', 'nos vemos', 'cuidate',
             'buen dia', 'buena tarde', 'buena noche', 'bye',
             'goodbye', 'see you', 'take care'
         ]
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_records = 0
         
-        # Initialize memory file if it doesn't exist
+        self._replay()
+        with self._lock:
+            if time.time() - self.last_activity > self.timeout_seconds:
+                # The journal is rewritten just below, so no clear record is needed
+                self.conversations.clear()
+            # Start from a compact journal holding only the live messages
+            self._compact()
+    
+    def _replay(self):
+        """Rebuild the buffer from the journal; a torn last line from a crash is skipped"""
         if not self.memory_file.exists():
-            self._save_memory({
-                "conversations": [],
-                "last_updated": time.time()
-            })
-        
-        # Start cleanup thread
-        self.cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
-        self.cleanup_thread.start()
+            return
+        with open(self.memory_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("clear"):
+                    self.conversations.clear()
+                else:
+                    self.conversations.append(record)
+                self.last_activity = record.get("timestamp", self.last_activity)
     
-    def _save_memory(self, memory_data):
-        """Save memory data to file."""
-        with open(self.memory_file, 'w', encoding='utf-8') as f:
-            json.dump(memory_data, f, ensure_ascii=False, indent=2)
+    def _append(self, record):
+        """Write one journal record, compacting the journal when it grows too long"""
+        self._journal.write(json.dumps(_message_record(record), ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self._journal_records += 1
+        if self._journal_records >= self.compact_every:
+            self._compact()
     
-    def _load_memory(self):
-        """Load memory data from file."""
-        try:
-            with open(self.memory_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {"conversations": [], "last_updated": time.time()}
+    def _compact(self):
+        """Atomically replace the journal with one record per buffered message"""
+        if self._journal is not None:
+            # Close before replacing the file (required on Windows)
+            self._journal.close()
+        tmp_path = self.memory_file.with_name(self.memory_file.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for message in self.conversations:
+                f.write(json.dumps(_message_record(message), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.memory_file)
+        self._journal = open(self.memory_file, 'a', encoding='utf-8')
+        self._journal_records = len(self.conversations)
     
-    def _cleanup_loop(self):
-        """Background thread to check for timeout and cleanup memory."""
-        while True:
-            time.sleep(10)  # Check every 10 seconds
-            current_time = time.time()
-            memory_data = self._load_memory()
-            
-            # Check for timeout
-            if current_time - memory_data["last_updated"] > self.timeout_seconds:
-                self._save_memory({
-                    "conversations": [],
-                    "last_updated": current_time
-                })
+    def _clear(self, current_time: float):
+        self.conversations.clear()
+        self.last_activity = current_time
+        self._append({"clear": True, "timestamp": current_time})
+    
+    def _expire_if_idle(self, current_time: float):
+        """Forget the conversation after timeout_seconds without activity"""
+        if self.conversations and current_time - self.last_activity > self.timeout_seconds:
+            self._clear(current_time)
     
     def add_interaction(self, role: str, content: str):
         """Add a new interaction to the conversation history."""
-        memory_data = self._load_memory()
         current_time = time.time()
-        
-        # Check for goodbye message
-        if role == "user" and any(phrase in content.lower() for phrase in self.goodbye_phrases):
-            self._save_memory({
-                "conversations": [],
-                "last_updated": current_time
-            })
-            return
-        
-        # Add new interaction
-        memory_data["conversations"].append({
-            "role": role,
-            "content": content,
-            "timestamp": current_time
-        })
-        
-        # Maintain max size
-        if len(memory_data["conversations"]) > self.max_memory_size:
-            memory_data["conversations"] = memory_data["conversations"][-self.max_memory_size:]
-        
-        memory_data["last_updated"] = current_time
-        self._save_memory(memory_data)
-        self.last_activity = current_time
+        with self._lock:
+            self._expire_if_idle(current_time)
+            
+            # Check for goodbye message
+            if role == "user" and any(phrase in content.lower() for phrase in self.goodbye_phrases):
+                self._clear(current_time)
+                return
+            
+            # The ring buffer drops the oldest message beyond max_memory_size
+            message = {
+                "role": role,
+                "content": content,
+                "timestamp": current_time
+            }
+            self.conversations.append(message)
+            self.last_activity = current_time
+            self._append(message)
     
-    def get_relevant_context(self, current_query: str, ollama_model: str) -> str:
+    def get_relevant_context(self, current_query: str) -> str:
         """Get relevant context from memory based on the current query."""
-        memory_data = self._load_memory()
-        if not memory_data["conversations"]:
+        with self._lock:
+            self._expire_if_idle(time.time())
+            conversations = list(self.conversations)
+        if not conversations:
             return ""
         
         # Get all conversations
         all_context = []
-        for conv in memory_data["conversations"]:
+        for conv in conversations:
             all_context.append(f"{conv['role']}: {conv['content']}")
         
         # If we have too much context, use embeddings to find most relevant parts
         if len(all_context) > 5:
-            # Get embedding for current query
-            query_embedding = ollama.embeddings(model=ollama_model, prompt=current_query)["embedding"]
-            
-            # Get embeddings for all context
-            context_embeddings = []
-            for ctx in all_context:
-                embedding = ollama.embeddings(model=ollama_model, prompt=ctx)["embedding"]
-                context_embeddings.append(embedding)
+            # Messages are embedded once with the embedding model and keep their vector;
+            # the query is embedded in the same request as any messages added since
+            missing = [i for i, conv in enumerate(conversations) if "embedding" not in conv]
+            query_embedding, *new_embeddings = normalize_rows(
+                embedding_client.embed([current_query] + [all_context[i] for i in missing])
+            )
+            for i, embedding in zip(missing, new_embeddings):
+                conversations[i]["embedding"] = embedding
             
-            # Calculate similarities
-            similarities = []
-            for ctx_emb in context_embeddings:
-                similarity = np.dot(query_embedding, ctx_emb) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(ctx_emb)
-                )
-                similarities.append(similarity)
+            # Cosine similarities of all messages in one matrix-vector product
+            similarities = np.stack([conv["embedding"] for conv in conversations]) @ query_embedding
             
             # Get top 5 most relevant contexts
             top_indices = np.argsort(similarities)[-5:]
@@ -184,29 +211,77 @@ class MemoryManager:
     
     def get_full_history(self) -> List[Dict[str, Any]]:
         """Get the full conversation history."""
-        memory_data = self._load_memory()
-        return memory_data["conversations"]
+        with self._lock:
+            self._expire_if_idle(time.time())
+            return [_message_record(conv) for conv in self.conversations]
 
 # Update the ollama_chat function to use MemoryManager
-def ollama_chat(user_input, system_message, vault_embeddings, vault_content, ollama_model, memory_manager: MemoryManager, config):
+def same_query(rewritten_query, user_input):
+    """Whether the rewrite returned the query unchanged, ignoring case, spacing and the prompt's brackets"""
+    def normalize(text):
+        return " ".join(text.strip().strip("[]\"'").split()).casefold()
+    return normalize(rewritten_query) == normalize(user_input)
+
+async def ollama_chat(user_input, system_message, vault_embeddings, vault_content, ollama_model, memory_manager: MemoryManager, config):
+    turn_start = time.perf_counter()
+    timings = {}
+    
+    async def timed(stage, fn, *fn_args):
+        """Run a blocking stage in a worker thread and record its duration"""
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(fn, *fn_args)
+        finally:
+            timings[stage] = (time.perf_counter() - start) * 1000
+    
     # Add user input to memory
     memory_manager.add_interaction("user", user_input)
     
-    # Get relevant context from memory
-    memory_context = memory_manager.get_relevant_context(user_input, ollama_model)
+    # Memory retrieval and a speculative document retrieval on the raw query
+    # run while the LLM rewrites the query
+    memory_task = asyncio.create_task(timed("memory", memory_manager.get_relevant_context, user_input))
+    speculative_task = asyncio.create_task(
+        timed("retrieval", get_relevant_context, user_input, vault_embeddings, vault_content)
+    )
     
-    # Always use query rewriting for better context understanding
-    query_json = {
-        "Query": user_input,
-        "Rewritten Query": ""
-    }
-    rewritten_query_json = rewrite_query(json.dumps(query_json), memory_manager.get_full_history(), ollama_model, config)
-    rewritten_query_data = json.loads(rewritten_query_json)
-    rewritten_query = rewritten_query_data["Rewritten Query"]
-    print(PINK + "Original Query: " + user_input + RESET_COLOR)
-    print(PINK + "Rewritten Query: " + rewritten_query + RESET_COLOR)
+    try:
+        # Always use query rewriting for better context understanding
+        query_json = {
+            "Query": user_input,
+            "Rewritten Query": ""
+        }
+        rewritten_query_json = await timed(
+            "rewrite", rewrite_query, json.dumps(query_json), memory_manager.get_full_history(), ollama_model, config
+        )
+        rewritten_query_data = json.loads(rewritten_query_json)
+        rewritten_query = rewritten_query_data["Rewritten Query"]
+        print(PINK + "Original Query: " + user_input + RESET_COLOR)
+        print(PINK + "Rewritten Query: " + rewritten_query + RESET_COLOR)
+        
+        if same_query(rewritten_query, user_input):
+            # The speculative retrieval already used this query
+            relevant_context = await speculative_task
+            retrieval_note = "reused"
+        else:
+            # Cancelling only stops waiting: the worker thread still finishes its query
+            # embedding, alongside the retrieval for the rewritten query
+            speculative_task.cancel()
+            relevant_context = await timed("retrieval", get_relevant_context, rewritten_query, vault_embeddings, vault_content)
+            retrieval_note = "after rewrite"
+        memory_context = await memory_task
+    finally:
+        # If a stage failed, stop waiting on the others and collect their outcome
+        # so their exceptions are not reported as never retrieved
+        memory_task.cancel()
+        speculative_task.cancel()
+        await asyncio.gather(memory_task, speculative_task, return_exceptions=True)
     
-    relevant_context = get_relevant_context(rewritten_query, vault_embeddings, vault_content)
+    # Document context fills the token budget first, conversation context gets what is left
+    relevant_context, _, context_tokens = context_packer.pack(relevant_context)
+    memory_lines, _, memory_tokens = context_packer.pack(
+        memory_context.split("\n") if memory_context else [],
+        budget=context_packer.budget_tokens - context_tokens
+    )
     if relevant_context:
         context_str = "\n".join(relevant_context)
         print("Context Pulled from Documents: \n\n" + CYAN + context_str + RESET_COLOR)
@@ -215,26 +290,37 @@ def ollama_chat(user_input, system_message, vault_embeddings, vault_content, oll
     
     # Combine memory context with document context
     user_input_with_context = user_input
-    if memory_context:
-        user_input_with_context += "\n\nConversation Context:\n" + memory_context
+    if memory_lines:
+        user_input_with_context += "\n\nConversation Context:\n" + "\n".join(memory_lines)
     if relevant_context:
         user_input_with_context += "\n\nDocument Context:\n" + context_str
     
-    # Create messages array with system message and conversation history
+    # Earlier turns reach the model only as the packed conversation context above,
+    # so the prompt stays within the token budget however long the conversation gets
     messages = [
         {"role": "system", "content": system_message},
-        *memory_manager.get_full_history()
+        {"role": "user", "content": user_input_with_context}
     ]
     
-    response = client.chat.completions.create(
+    response = await timed("generation", lambda: client.chat.completions.create(
         model=ollama_model,
         messages=messages,
         max_tokens=2000,
-    )
+    ))
+    
+    estimated_tokens = sum(context_packer.estimate(m["content"]) for m in messages)
+    reported_tokens = response.usage.prompt_tokens if response.usage else None
+    print(YELLOW + f"Prompt tokens: {reported_tokens or estimated_tokens}"
+          f" (context {context_tokens + memory_tokens}/{context_packer.budget_tokens})" + RESET_COLOR)
     
     # Add assistant's response to memory
     memory_manager.add_interaction("assistant", response.choices[0].message.content)
     
+    timings["total"] = (time.perf_counter() - turn_start) * 1000
+    print(YELLOW + f"Timings: memory {timings['memory']:.0f} ms | rewrite {timings['rewrite']:.0f} ms"
+          f" | retrieval {timings['retrieval']:.0f} ms ({retrieval_note})"
+          f" | generation {timings['generation']:.0f} ms | total {timings['total']:.0f} ms" + RESET_COLOR)
+    
     return response.choices[0].message.content
 
 # Parse command-line arguments
@@ -247,6 +333,12 @@ args = parser.parse_args()
 print(NEON_GREEN + "Loading configuration..." + RESET_COLOR)
 config = load_config()
 
+# Shared batched embedding client
+embedding_client = EmbeddingClient.from_config(config)
+
+# Caps the document and conversation context added to each prompt
+context_packer = ContextPacker.from_config(config.get('context'))
+
 # Configuration for the Ollama API client
 print(NEON_GREEN + "Initializing Ollama API client..." + RESET_COLOR)
 client = OpenAI(
@@ -256,23 +348,13 @@ client = OpenAI(
 
 # Load the vault content
 print(NEON_GREEN + "Loading vault content..." + RESET_COLOR)
-vault_content = []
-if os.path.exists(config['vault_file']):
-    with open(config['vault_file'], "r", encoding='utf-8') as vault_file:
-        vault_content = vault_file.readlines()
+vault_content = read_vault(config['vault_file'])
 
-# Generate embeddings for the vault content using Ollama
-print(NEON_GREEN + "Generating embeddings for the vault content..." + RESET_COLOR)
-vault_embeddings = []
-for content in vault_content:
-    response = ollama.embeddings(model=config['model']['embedding_model'], prompt=content)
-    vault_embeddings.append(response["embedding"])
-
-# Convert to tensor and print embeddings
-print("Converting embeddings to tensor...")
-vault_embeddings_tensor = torch.tensor(vault_embeddings) 
-print("Embeddings for each line in the vault:")
-print(vault_embeddings_tensor)
+# Map the embeddings written at ingestion; only new or changed lines are embedded
+print(NEON_GREEN + "Loading embeddings for the vault content..." + RESET_COLOR)
+embedding_store = EmbeddingStore(config['embeddings_file'], config['model']['embedding_model'])
+vault_embeddings = embedding_store.get_matrix(vault_content, embedding_client.embed)
+print(f"{len(vault_content)} vault lines ready")
 
 # Update the conversation loop to use memory_manager instead of conversation_history
 print("Starting conversation loop...")
@@ -286,15 +368,15 @@ while True:
             print(NEON_GREEN + "Goodbye!" + RESET_COLOR)
             break
         
-        response = ollama_chat(
+        response = asyncio.run(ollama_chat(
             user_input,
             system_message,
-            vault_embeddings_tensor,
+            vault_embeddings,
             vault_content,
             args.model,
             memory_manager,
             config
-        )
+        ))
         print(NEON_GREEN + "\nAssistant: " + RESET_COLOR + response)
         
     except KeyboardInterrupt:
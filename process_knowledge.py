@@ -1,8 +1,16 @@
 import os
 import re
 import json
+import codecs
 import PyPDF2
+import yaml
 from text.cleaners import spanish_cleaner, spanish_cleaner_with_accents
+from embedding_store import EmbeddingStore
+from embedding_client import EmbeddingClient
+from ann_index import build_index
+from lexical_index import build_lexical_index
+from quantization import build_quantized
+from projection import project_matrix
 
 def process_text_file(file_path):
     with open(file_path, 'r', encoding="utf-8") as txt_file:
@@ -46,6 +54,28 @@ def process_text(text):
     
     return chunks
 
+def build_vault_embeddings():
+    """Embed the vault and build its search indexes so queries only embed the query"""
+    with codecs.open("config.yaml", "r", encoding="utf-8-sig") as f:
+        config = yaml.safe_load(f)
+    
+    with codecs.open("vault.txt", "r", encoding="utf-8-sig") as f:
+        chunks = [line.strip() for line in f if line.strip()]
+    
+    if not chunks:
+        # Nothing to index; the store's fingerprint still names the previous vault
+        print("No chunks to embed")
+        return
+    
+    store = EmbeddingStore(config["embeddings_file"], config["model"]["embedding_model"])
+    matrix = store.get_matrix(chunks, EmbeddingClient.from_config(config).embed)
+    build_lexical_index(config, chunks, store.fingerprint)
+    # Indexes are built on the projected vectors when a projection is configured
+    _, matrix, fingerprint = project_matrix(config, matrix, store.fingerprint)
+    build_index(config, matrix, fingerprint)
+    build_quantized(config, matrix, fingerprint)
+    print(f"Embedded {len(chunks)} chunks")
+
 def main():
     # Clear the vault.txt file
     with open("vault.txt", "w", encoding="utf-8") as vault_file:
@@ -72,6 +102,8 @@ def main():
                 vault_file.write(chunk.strip() + "\n")
         
         print(f"Processed {filename}")
+    
+    build_vault_embeddings()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+
+from embedding_store import normalize_rows
+
+
+class Projection:
+    """Linear reduction of embeddings to `dim` dimensions, fitted at ingest.
+
+    "pca" centers the vectors and keeps the top principal components of the
+    vault; "truncate" keeps the first `dim` coordinates, which is all
+    Matryoshka-trained models need. The same projection is applied to
+    queries, and projected vectors are re-normalized so cosine scoring
+    works unchanged.
+    """
+
+    KINDS = ("pca", "truncate")
+
+    def __init__(self, kind: str, dim: int, mean: np.ndarray = None, components: np.ndarray = None,
+                 fingerprint: str = ""):
+        if kind not in self.KINDS:
+            raise Exception(f"Unknown projection type: {kind}")
+        self.kind = kind
+        self.dim = dim
+        self.mean = mean
+        self.components = components
+        self.fingerprint = fingerprint
+
+    @property
+    def tag(self) -> str:
+        """Short name of the projection, e.g. pca256"""
+        return f"{self.kind}{self.dim}"
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, kind: str, dim: int, fingerprint: str = "",
+            max_train: int = 100000, seed: int = 0):
+        dim = min(dim, matrix.shape[1])
+        if kind == "truncate":
+            return cls(kind, dim, fingerprint=fingerprint)
+
+        n = matrix.shape[0]
+        if n > max_train:
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(matrix[np.sort(rng.choice(n, max_train, replace=False))])
+        else:
+            sample = np.asarray(matrix)
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+        # Eigenvectors of the D x D covariance; cheaper than an SVD of the N x D sample
+        eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        components = eigenvectors[:, np.argsort(eigenvalues)[::-1][:dim]].T
+        return cls(kind, dim, mean.astype(np.float32), np.ascontiguousarray(components, dtype=np.float32),
+                   fingerprint)
+
+    def apply(self, vectors) -> np.ndarray:
+        """Project one vector or a matrix of row vectors and re-normalize"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.kind == "truncate":
+            return normalize_rows(vectors[..., :self.dim])
+        return normalize_rows((vectors - self.mean) @ self.components.T)
+
+    def save(self, path: str):
+        """Write the projection atomically"""
+        tmp_path = path + ".tmp"
+        empty = np.empty(0, dtype=np.float32)
+        with open(tmp_path, "wb") as f:
+            np.savez(f, kind=np.array(self.kind), dim=np.array(self.dim),
+                     mean=self.mean if self.mean is not None else empty,
+                     components=self.components if self.components is not None else empty,
+                     fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a projection written by save(), or None if missing or unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                mean = data["mean"] if data["mean"].size else None
+                components = data["components"] if data["components"].size else None
+                return cls(str(data["kind"]), int(data["dim"]), mean, components, str(data["fingerprint"]))
+        except (ValueError, KeyError, OSError):
+            print(f"Ignoring unreadable projection file: {path}")
+            return None
+
+
+def projection_settings(config):
+    """(type, dim) of the configured projection, or None when vectors keep their full dimension"""
+    projection_config = config.get("projection", {})
+    kind = projection_config.get("type", "none")
+    if kind == "none":
+        return None
+    return kind, projection_config["dim"]
+
+
+def fit_projection(config, matrix: np.ndarray, fingerprint: str):
+    """Fit and save the configured projection for matrix, or return None if disabled"""
+    settings = projection_settings(config)
+    if settings is None or matrix.shape[0] == 0:
+        return None
+    kind, dim = settings
+    print(f"Fitting {kind} projection to {dim} dimensions over {matrix.shape[0]} vectors...")
+    projection = Projection.fit(matrix, kind, dim, fingerprint)
+    projection.save(config["projection"]["file"])
+    return projection
+
+
+def load_or_fit_projection(config, matrix: np.ndarray, fingerprint: str):
+    """Return the saved projection if it matches the matrix fingerprint and settings, refitting it if stale"""
+    settings = projection_settings(config)
+    if settings is None or matrix.shape[0] == 0:
+        return None
+    kind, dim = settings[0], min(settings[1], matrix.shape[1])
+    projection = Projection.load(config["projection"]["file"])
+    if projection is not None and projection.fingerprint == fingerprint and projection.tag == f"{kind}{dim}":
+        return projection
+    return fit_projection(config, matrix, fingerprint)
+
+
+def project_matrix(config, matrix: np.ndarray, fingerprint: str):
+    """Apply the configured projection to the vault matrix.
+
+    Returns (projection, matrix, fingerprint); the fingerprint names the
+    projected matrix, so indexes built on it never match the full one.
+    """
+    projection = load_or_fit_projection(config, matrix, fingerprint)
+    if projection is None:
+        return None, matrix, fingerprint
+    projected = np.empty((matrix.shape[0], projection.dim), dtype=np.float32)
+    for start in range(0, matrix.shape[0], 65536):
+        projected[start:start + 65536] = projection.apply(matrix[start:start + 65536])
+    return projection, projected, f"{fingerprint}:{projection.tag}"
@@ -0,0 +1,38 @@
+import string
+
+
+class PromptBuilder:
+    """Chat messages for answering a query, compiled once from config.yaml.
+
+    The system message and the personality instructions are rendered at
+    startup into one constant system prompt, so every request shares the
+    same leading prefix and Ollama can reuse its cached evaluation of it.
+    Only the user message, with the retrieved context and the query at the
+    end, changes between requests.
+    """
+
+    USER_FIELDS = {"context", "query"}
+
+    def __init__(self, system_prompt: str, user_template: str):
+        fields = {name for _, name, _, _ in string.Formatter().parse(user_template) if name is not None}
+        if fields - self.USER_FIELDS:
+            raise Exception(f"prompt_template may only use {{context}} and {{query}}, found: {sorted(fields)}")
+        self.system_prompt = system_prompt
+        self.user_template = user_template
+
+    @classmethod
+    def from_config(cls, config):
+        """Render the personality instructions once and append them to the system message"""
+        instructions = config.get("prompt_instructions", "").format(personality=config["personality"]).strip()
+        system_prompt = config["system_message"].rstrip()
+        if instructions:
+            system_prompt += "\n\n" + instructions
+        return cls(system_prompt, config["prompt_template"])
+
+    def messages(self, context: str, query: str, history=()) -> list[dict]:
+        """System prefix, then earlier turns of the conversation, then this turn with its context"""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            *history,
+            {"role": "user", "content": self.user_template.format(context=context, query=query)}
+        ]
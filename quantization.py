@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+
+from vector_search import top_k
+
+# Rows processed per block when building and Hamming-scoring codes
+_SCORE_BLOCK = 65536
+# int8 rows converted to float32 per block; small blocks stay in CPU cache
+_INT8_BLOCK = 4096
+
+# Set bits per byte value, for NumPy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(bytes_: np.ndarray) -> np.ndarray:
+    """Number of set bits in each row of a uint8 array"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bytes_).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bytes_].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedVectors:
+    """Compact codes for an L2-normalized embedding matrix.
+
+    "int8" keeps one signed byte per dimension, scaled by the dimension's
+    largest magnitude (4x smaller than float32). "binary" keeps only the
+    sign bit (32x smaller) and ranks rows by Hamming distance. Either can
+    prefilter candidates that are then rescored exactly against the
+    memory-mapped float matrix, so only those rows are ever paged in.
+    """
+
+    KINDS = ("int8", "binary")
+
+    def __init__(self, kind: str, codes: np.ndarray, dim: int, scales: np.ndarray = None, fingerprint: str = ""):
+        if kind not in self.KINDS:
+            raise Exception(f"Unknown quantization type: {kind}")
+        self.kind = kind
+        self.codes = codes
+        self.dim = dim
+        self.scales = scales
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, kind: str, fingerprint: str = ""):
+        n, dim = matrix.shape
+        if kind == "binary":
+            codes = np.empty((n, (dim + 7) // 8), dtype=np.uint8)
+            for start in range(0, n, _SCORE_BLOCK):
+                block = np.asarray(matrix[start:start + _SCORE_BLOCK])
+                codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+            return cls(kind, codes, dim, fingerprint=fingerprint)
+
+        scales = np.zeros(dim, dtype=np.float32)
+        for start in range(0, n, _SCORE_BLOCK):
+            scales = np.maximum(scales, np.abs(np.asarray(matrix[start:start + _SCORE_BLOCK])).max(axis=0))
+        scales[scales == 0] = 1.0
+        codes = np.empty((n, dim), dtype=np.int8)
+        for start in range(0, n, _SCORE_BLOCK):
+            block = np.asarray(matrix[start:start + _SCORE_BLOCK]) / scales * 127
+            codes[start:start + len(block)] = np.clip(np.rint(block), -127, 127)
+        return cls(kind, codes, dim, scales, fingerprint)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def save(self, path: str):
+        """Write the codes atomically"""
+        tmp_path = path + ".tmp"
+        scales = self.scales if self.scales is not None else np.empty(0, dtype=np.float32)
+        with open(tmp_path, "wb") as f:
+            np.savez(f, kind=np.array(self.kind), codes=self.codes, dim=np.array(self.dim),
+                     scales=scales, fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load codes written by save(), or None if missing or unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                scales = data["scales"] if data["scales"].size else None
+                return cls(str(data["kind"]), data["codes"], int(data["dim"]), scales, str(data["fingerprint"]))
+        except (ValueError, KeyError, OSError):
+            print(f"Ignoring unreadable quantized vectors file: {path}")
+            return None
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarity of the query to every row"""
+        query = np.asarray(query, dtype=np.float32)
+        n = self.codes.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        if self.kind == "binary":
+            query_bits = np.packbits(query > 0)
+            for start in range(0, n, _SCORE_BLOCK):
+                distance = _popcount(np.bitwise_xor(self.codes[start:start + _SCORE_BLOCK], query_bits))
+                scores[start:start + len(distance)] = 1 - 2 * distance / self.dim
+        else:
+            # Fold the per-dimension scales into the query once instead of dequantizing rows
+            scaled_query = query * (self.scales / 127)
+            for start in range(0, n, _INT8_BLOCK):
+                block = self.codes[start:start + _INT8_BLOCK]
+                scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def search(self, query: np.ndarray, k: int, matrix: np.ndarray = None, rescore_candidates: int = 100):
+        """Top-k by approximate score; with matrix, rescore the best candidates exactly.
+
+        Returns (indices, scores) like vector_search.top_k.
+        """
+        scores = self.scores(query)
+        n = len(scores)
+        k = min(k, n)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if matrix is None:
+            candidates = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+            indices = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return indices, scores[indices]
+
+        m = min(max(k, rescore_candidates), n)
+        candidates = np.argpartition(-scores, m - 1)[:m] if m < n else np.arange(n)
+        candidates.sort()
+        local, exact = top_k(matrix[candidates], query, k)
+        return candidates[local], exact
+
+
+def quantization_type(config) -> str:
+    return config.get("quantization", {}).get("type", "none")
+
+
+def build_quantized(config, matrix: np.ndarray, fingerprint: str):
+    """Build and save the configured quantized codes for matrix, or return None if disabled"""
+    kind = quantization_type(config)
+    if kind == "none" or matrix.shape[0] == 0:
+        return None
+    print(f"Quantizing {matrix.shape[0]} vectors ({kind})...")
+    quantized = QuantizedVectors.build(matrix, kind, fingerprint)
+    quantized.save(config["quantization"]["file"])
+    return quantized
+
+
+def load_or_build_quantized(config, matrix: np.ndarray, fingerprint: str):
+    """Return the saved codes if they match the matrix fingerprint and type, rebuilding them if stale"""
+    kind = quantization_type(config)
+    if kind == "none" or matrix.shape[0] == 0:
+        return None
+    quantized = QuantizedVectors.load(config["quantization"]["file"])
+    if quantized is not None and quantized.fingerprint == fingerprint and quantized.kind == kind:
+        return quantized
+    return build_quantized(config, matrix, fingerprint)
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """Bounded LRU cache with per-entry TTL and hit/miss counters.
+
+    max_size <= 0 disables caching; ttl_seconds <= 0 means entries never expire.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_config):
+        cache_config = cache_config or {}
+        return cls(cache_config.get("max_size", 1024), cache_config.get("ttl_seconds", 0))
+
+    def get(self, key):
+        """Return the cached value or None, refreshing its LRU position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SemanticAnswerCache:
+    """LRU cache of generated answers, matched by query similarity.
+
+    An entry is (normalized query embedding, retrieved chunk ids, answer). A
+    lookup hits when a cached query retrieved the same chunk set and its
+    embedding is within `similarity_threshold` cosine of the new query.
+    All entries are dropped when the vault snapshot version changes.
+    """
+
+    def __init__(self, max_size: int = 512, similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_config):
+        cache_config = cache_config or {}
+        return cls(cache_config.get("max_size", 512), cache_config.get("similarity_threshold", 0.95))
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, query_vector, chunk_ids, version):
+        """Return the cached answer for a paraphrase of the query, or None"""
+        chunk_ids = frozenset(int(i) for i in chunk_ids)
+        with self._lock:
+            self._check_version(version)
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id, (vector, entry_chunk_ids, _) in self._entries.items():
+                if entry_chunk_ids != chunk_ids:
+                    continue
+                score = float(np.dot(vector, query_vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def put(self, query_vector, chunk_ids, answer: str, version):
+        if self.max_size <= 0:
+            return
+        chunk_ids = frozenset(int(i) for i in chunk_ids)
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_id] = (np.asarray(query_vector, dtype=np.float32), chunk_ids, answer)
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
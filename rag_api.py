@@ -1,132 +1,354 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-import ollama
 from text.cleaners import spanish_cleaner_with_accents
-import os
+from embedding_store import EmbeddingStore, normalize_rows
+from embedding_client import EmbeddingClient
+from async_ollama import AsyncOllamaClient
+from ann_index import search
+from lexical_index import is_confident, reciprocal_rank_fusion
+from vault_snapshot import VaultSnapshot, VaultWatcher
+from query_cache import LRUCache, SemanticAnswerCache
+from singleflight import SingleFlight
+from scheduler import RequestScheduler, SchedulerBusy
+from metrics import Registry
+from prompting import PromptBuilder
+from context_packer import ContextPacker
+from session_memory import SessionStore
+from contextlib import asynccontextmanager
+from functools import lru_cache
 import yaml
 import json
 import codecs
 import asyncio
-
-app = FastAPI(title="Spanish RAG API")
+import itertools
+import time
+from collections import deque
 
 # Load configuration with UTF-8 BOM
 with codecs.open("config.yaml", "r", encoding="utf-8-sig") as f:
     config = yaml.safe_load(f)
 
+# Batched embedding client for (re)building the vault off the event loop
+embedding_client = EmbeddingClient.from_config(config)
+
+# Pooled async client with bounded embedding/generation concurrency for requests
+ollama_client = AsyncOllamaClient.from_config(config)
+
+# System prompt and personality instructions are rendered once into a constant prefix
+prompt_builder = PromptBuilder.from_config(config)
+
+# Retrieved chunks are packed into a fixed token budget to bound prompt size
+context_packer = ContextPacker.from_config(config.get("context"))
+
+# Vault chunk embeddings persist across queries and restarts
+embedding_store = EmbeddingStore(config["embeddings_file"], config["model"]["embedding_model"])
+
+# The vault stays resident in memory and is reloaded when vault.txt changes
+vault_watcher = VaultWatcher(config, embedding_store, embedding_client.embed)
+
+# Repeated queries skip cleaning, the query embedding and the similarity scan
+query_cache = LRUCache.from_config(config.get("query_cache"))
+clean_query = lru_cache(maxsize=max(query_cache.max_size, 1))(spanish_cleaner_with_accents)
+
+# Paraphrased queries that retrieve the same context reuse the stored answer
+answer_cache = SemanticAnswerCache.from_config(config.get("answer_cache"))
+
+# Identical queries arriving while one is being answered share its work
+single_flight = SingleFlight()
+
+# Per-session conversation memory for /airesponse, bounded by LRU and idle TTL
+sessions = SessionStore.from_config(config.get("sessions"))
+# Turns with history skip the answer cache and coalescing, so connections can go without memory
+per_connection_sessions = config.get("sessions", {}).get("per_connection", True)
+
+# Bounded concurrency and queueing for query processing, fair across connections
+scheduler = RequestScheduler.from_config(config.get("scheduler"))
+connection_ids = itertools.count()
+
+# Prometheus metrics for the request path, served on /metrics
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a query", ("stage",)
+)
+tokens_generated = metrics.counter("rag_tokens_generated_total", "Tokens generated by the LLM")
+queries_total = metrics.counter("rag_queries_total", "Queries answered, by outcome", ("outcome",))
+prompt_tokens = metrics.histogram(
+    "rag_prompt_tokens", "Estimated prompt tokens per generated answer", (),
+    (128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+)
+active_websockets = metrics.gauge("rag_active_websockets", "Open /airesponse websocket connections")
+metrics.callback("rag_queue_depth", "Queries waiting for a scheduler slot", lambda: scheduler.queue_depth)
+metrics.callback("rag_active_queries", "Queries holding a scheduler slot", lambda: scheduler.active)
+metrics.callback("rag_rejected_total", "Queries rejected with a busy frame",
+                 lambda: scheduler.rejected, "counter")
+metrics.callback("rag_query_cache_hits_total", "Query cache hits", lambda: query_cache.hits, "counter")
+metrics.callback("rag_query_cache_misses_total", "Query cache misses", lambda: query_cache.misses, "counter")
+metrics.callback("rag_answer_cache_hits_total", "Semantic answer cache hits", lambda: answer_cache.hits, "counter")
+metrics.callback("rag_answer_cache_misses_total", "Semantic answer cache misses",
+                 lambda: answer_cache.misses, "counter")
+metrics.callback("rag_sessions", "Conversation sessions held in memory", lambda: len(sessions))
+metrics.callback("rag_coalesced_total", "Queries attached to an identical in-flight query",
+                 lambda: single_flight.coalesced, "counter")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await vault_watcher.start()
+    yield
+    await vault_watcher.stop()
+
+app = FastAPI(title="Spanish RAG API", lifespan=lifespan)
+
 class Query(BaseModel):
     text: str
 
 class Response(BaseModel):
     answer: str
     sources: list[str]
+    cached: bool = False
+    usage: dict = {}
+    timing: dict = {}
 
     class Config:
         json_schema_extra = {
             "example": {
                 "answer": "This is a sample response",
-                "sources": ["Source 1", "Source 2"]
+                "sources": ["Source 1", "Source 2"],
+                "cached": False,
+                "usage": {"context_tokens": 310, "prompt_tokens": 520, "prompt_eval_count": 498},
+                "timing": {"first_token_ms": 350.0, "prompt_eval_ms": 120.0, "total_ms": 1800.0}
             }
         }
 
-def load_vault():
-    """Load the processed documents from vault.txt"""
-    if not os.path.exists("vault.txt"):
-        return []
-    
-    with codecs.open("vault.txt", "r", encoding="utf-8-sig") as f:
-        return [line.strip() for line in f if line.strip()]
+async def retrieve(query: str, snapshot: VaultSnapshot, top_k_chunks: int = None):
+    """Return the normalized query embedding and the indices of the most relevant chunks.
 
-def get_relevant_chunks(query: str, chunks: list[str], top_k: int = None):
-    """Get the most relevant chunks for the query using Ollama embeddings"""
-    if top_k is None:
-        top_k = config["model"]["top_k_chunks"]
+    The embedding is None when BM25 alone answered (lexical mode or a
+    confident lexical fast path), since the query was never embedded.
+    """
+    if top_k_chunks is None:
+        top_k_chunks = config["model"]["top_k_chunks"]
+    retrieval = config.get("retrieval", {})
+    mode = retrieval.get("mode", "dense")
+
+    cache_key = (query, config["model"]["embedding_model"], snapshot.version, top_k_chunks)
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        query_embedding, top_indices = cached
+    else:
+        query_embedding, top_indices = None, None
+        candidates = max(top_k_chunks, retrieval.get("candidates", 50))
         
-    # Get query embedding
-    query_embedding = ollama.embeddings(model=config["model"]["embedding_model"], prompt=query)["embedding"]
-    
-    # Get chunk embeddings
-    chunk_embeddings = []
-    for chunk in chunks:
-        embedding = ollama.embeddings(model=config["model"]["embedding_model"], prompt=chunk)["embedding"]
-        chunk_embeddings.append(embedding)
-    
-    # Calculate cosine similarity
-    similarities = []
-    for chunk_emb in chunk_embeddings:
-        similarity = sum(a * b for a, b in zip(query_embedding, chunk_emb))
-        similarities.append(similarity)
-    
-    # Get top k chunks
-    top_indices = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)[:top_k]
-    return [chunks[i] for i in top_indices]
+        # Keyword lookups can skip the query embedding entirely
+        lexical_indices = None
+        if snapshot.lexical is not None:
+            with stage_seconds.time(stage="lexical_search"):
+                lexical_indices, lexical_scores, coverage = snapshot.lexical.search(query, candidates)
+            if (mode == "lexical" and len(lexical_indices)) or is_confident(config, lexical_scores, coverage):
+                top_indices = lexical_indices[:top_k_chunks]
+        
+        if top_indices is None:
+            # Get query embedding; chunk embeddings are already in the snapshot
+            with stage_seconds.time(stage="query_embedding"):
+                query_embedding = normalize_rows(await ollama_client.embed_one(query))
+                if snapshot.projection is not None:
+                    # Same reduction as the stored vectors
+                    query_embedding = snapshot.projection.apply(query_embedding)
+            
+            # Cosine similarity on normalized vectors, through the ANN index when enabled
+            dense_k = candidates if mode == "hybrid" else top_k_chunks
+            with stage_seconds.time(stage="vector_search"):
+                dense_indices, _ = search(config, snapshot.matrix, query_embedding, dense_k,
+                                          snapshot.index, snapshot.quantized)
+            if mode == "hybrid" and lexical_indices is not None and len(lexical_indices):
+                top_indices = reciprocal_rank_fusion(
+                    [dense_indices, lexical_indices], top_k_chunks, retrieval.get("rrf_k", 60)
+                )
+            else:
+                top_indices = dense_indices[:top_k_chunks]
+        query_cache.put(cache_key, (query_embedding, top_indices))
+    return query_embedding, top_indices
+
+async def get_relevant_chunks(query: str, snapshot: VaultSnapshot, top_k_chunks: int = None):
+    """Get the most relevant chunks for the query using Ollama embeddings"""
+    _, top_indices = await retrieve(query, snapshot, top_k_chunks)
+    return [snapshot.chunks[i] for i in top_indices]
+
+def message_content(response) -> str:
+    """Extract the message text from an Ollama chat response or stream part"""
+    # Handle both dictionary and object responses
+    if isinstance(response, dict):
+        if 'message' not in response or 'content' not in response['message']:
+            raise Exception("Invalid response format from Ollama")
+        return response['message']['content']
+    if not hasattr(response, 'message') or not hasattr(response.message, 'content'):
+        raise Exception("Invalid response format from Ollama")
+    return response.message.content
+
+async def process_query(query_text: str, on_token=None, history=()):
+    """Answer a query; when on_token is given the answer is streamed to it token by token.
 
-async def process_query(query_text: str):
+    history holds the earlier messages of the conversation, oldest first.
+    """
     try:
+        start_time = time.perf_counter()
+        
         # Clean and normalize the query
-        cleaned_query = spanish_cleaner_with_accents(query_text)
+        with stage_seconds.time(stage="clean"):
+            cleaned_query = clean_query(query_text)
         
-        # Load the vault
-        chunks = load_vault()
-        if not chunks:
+        # Use the current in-memory vault snapshot for the whole request
+        snapshot = vault_watcher.snapshot
+        if not snapshot.chunks:
             raise Exception("No documents found in vault.txt")
         
         # Get relevant chunks
-        relevant_chunks = get_relevant_chunks(cleaned_query, chunks)
-        
-        # Create context from relevant chunks
-        context = "\n".join(relevant_chunks)
+        query_embedding, top_indices = await retrieve(cleaned_query, snapshot)
+        relevant_chunks = [snapshot.chunks[i] for i in top_indices]
         
-        # Generate response using Ollama with personality from config
-        personality = config["personality"]
-        prompt = config["prompt_template"].format(
-            context=context,
-            query=cleaned_query,
-            personality={
-                "name": personality["name"],
-                "description": personality["description"],
-                "traits": personality["traits"],
-                "response_constraints": personality["response_constraints"]
+        # Skip the LLM when a paraphrase with the same context was already answered;
+        # answers that depend on earlier turns are never shared
+        cached_answer = None
+        if query_embedding is not None and not history:
+            cached_answer = answer_cache.get(query_embedding, top_indices, snapshot.version)
+        if cached_answer is not None:
+            queries_total.inc(outcome="answer_cache")
+            stage_seconds.observe(time.perf_counter() - start_time, stage="total")
+            elapsed_ms = round((time.perf_counter() - start_time) * 1000, 1)
+            return {
+                "answer": cached_answer,
+                "sources": relevant_chunks,
+                "cached": True,
+                "timing": {"first_token_ms": elapsed_ms, "total_ms": elapsed_ms}
             }
+        
+        prompt_start = time.perf_counter()
+        
+        # Fit the chunks into the token budget, best first, without near-duplicates
+        context_chunks, kept, context_tokens = context_packer.pack(
+            relevant_chunks, snapshot.token_counts[top_indices], snapshot.matrix[top_indices]
+        )
+        context = "\n".join(context_chunks)
+        # Earlier turns share the budget, getting whatever the retrieved context left
+        history, history_tokens = context_packer.pack_history(
+            history, context_packer.budget_tokens - context_tokens
         )
-
-        messages = [
-            {"role": "system", "content": config["system_message"]},
-            {"role": "user", "content": prompt}
-        ]
-
-        # Run Ollama chat in a thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: ollama.chat(
-            model=config["ollama_model"],
-            messages=messages,
-            options=config["model"]["parameters"]
-        ))
         
-        if not response:
-            raise Exception("Empty response from Ollama")
-            
-        # Handle both dictionary and object responses
-        if isinstance(response, dict):
-            if 'message' not in response or 'content' not in response['message']:
-                raise Exception("Invalid response format from Ollama")
-            answer = response['message']['content']
+        # Constant system prefix first, so Ollama can reuse its cached evaluation
+        messages = prompt_builder.messages(context, cleaned_query, history)
+        estimated_prompt_tokens = sum(context_packer.estimate(m["content"]) for m in messages)
+        prompt_tokens.observe(estimated_prompt_tokens)
+        llm_start = time.perf_counter()
+        stage_seconds.observe(llm_start - prompt_start, stage="prompt")
+
+        first_token_time = None
+        final = None
+        if on_token is not None:
+            # Forward tokens as they are generated; when every caller has gone the single-flight
+            # layer cancels this task, which closes the stream and stops generation
+            parts = []
+            async for part in ollama_client.chat_stream(messages, options=config["model"]["parameters"]):
+                if part.get("done"):
+                    final = part
+                token = message_content(part)
+                if not token:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                    stage_seconds.observe(first_token_time - llm_start, stage="llm_first_token")
+                parts.append(token)
+                tokens_generated.inc()
+                await on_token(token)
+            answer = "".join(parts)
         else:
-            if not hasattr(response, 'message') or not hasattr(response.message, 'content'):
-                raise Exception("Invalid response format from Ollama")
-            answer = response.message.content
+            response = await ollama_client.chat(messages, options=config["model"]["parameters"])
+            
+            if not response:
+                raise Exception("Empty response from Ollama")
+            answer = message_content(response)
+            tokens_generated.inc(response.get("eval_count") or 0)
+            final = response
+        
+        # Prompt evaluation time as reported by Ollama, low when the prefix was cached
+        prompt_eval_ms = None
+        if final is not None and final.get("prompt_eval_duration"):
+            stage_seconds.observe(final["prompt_eval_duration"] / 1e9, stage="llm_prompt_eval")
+            prompt_eval_ms = round(final["prompt_eval_duration"] / 1e6, 1)
+        
+        end_time = time.perf_counter()
+        stage_seconds.observe(end_time - llm_start, stage="llm")
+        stage_seconds.observe(end_time - start_time, stage="total")
+        queries_total.inc(outcome="generated")
         
         # Ensure proper UTF-8 BOM encoding
         answer = answer.encode('utf-8-sig', errors='ignore').decode('utf-8-sig')
+        if query_embedding is not None and not history:
+            answer_cache.put(query_embedding, top_indices, answer, snapshot.version)
         
         return {
             "answer": answer,
-            "sources": relevant_chunks
+            "sources": [relevant_chunks[i] for i in kept],
+            "cached": False,
+            "usage": {
+                "context_tokens": context_tokens,
+                "history_tokens": history_tokens,
+                "prompt_tokens": estimated_prompt_tokens,
+                # Tokens Ollama actually evaluated, None if not reported
+                "prompt_eval_count": final.get("prompt_eval_count") if final is not None else None
+            },
+            "timing": {
+                "first_token_ms": round(((first_token_time or end_time) - start_time) * 1000, 1),
+                "prompt_eval_ms": prompt_eval_ms,
+                "total_ms": round((end_time - start_time) * 1000, 1)
+            }
         }
     
     except Exception as e:
+        queries_total.inc(outcome="error")
         raise Exception(f"Error in process_query: {str(e)}")
 
+async def answer_query(query_text: str, on_token=None, connection_id=None, session_id=None):
+    """Answer a query, attaching to an identical in-flight query instead of starting new work.
+
+    New work waits for a scheduler slot and raises SchedulerBusy when the queue is full.
+    With a session_id the answer uses and extends that session's conversation.
+    """
+    history = sessions.history(session_id) if session_id is not None else []
+    key = (clean_query(query_text), vault_watcher.snapshot.version)
+    if history:
+        # Only first turns are alike across sessions
+        key += (session_id,)
+    
+    async def scheduled_query(broadcast):
+        queue_start = time.perf_counter()
+        async with scheduler.slot(connection_id):
+            stage_seconds.observe(time.perf_counter() - queue_start, stage="queue")
+            # The shared computation always streams so streaming callers can attach to it
+            return await process_query(query_text, on_token=broadcast, history=history)
+    
+    result, coalesced = await single_flight.run(key, scheduled_query, on_token)
+    if session_id is not None:
+        sessions.append(session_id, "user", query_text)
+        sessions.append(session_id, "assistant", result["answer"])
+    return {**result, "coalesced": coalesced}
+
+def error_frame(e: Exception) -> dict:
+    """Websocket frame for a failed query; overload is reported as an explicit busy frame"""
+    if isinstance(e, SchedulerBusy):
+        return {
+            "type": "busy",
+            "data": {
+                "message": "Server busy, please try again shortly",
+                "estimated_wait_s": round(e.estimated_wait, 1)
+            }
+        }
+    return {
+        "type": "error",
+        "data": {
+            "message": str(e)
+        }
+    }
+
 async def send_thinking_messages(websocket: WebSocket):
     try:
         message_count = 0
@@ -149,14 +371,60 @@ async def send_thinking_messages(websocket: WebSocket):
         print(f"\nUnexpected error in thinking messages: {str(e)}")  # Debug print
         raise
 
+async def receive_text(websocket: WebSocket, pending: deque) -> str:
+    """Next text message, taking those that arrived while a query was running first"""
+    message = pending.popleft() if pending else await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return message["text"]
+
+async def until_disconnect(websocket: WebSocket, coro, pending: deque):
+    """Run coro while watching the socket, cancelling it if the client disconnects.
+
+    Without this a query whose client left would keep its place in the scheduler
+    queue until it produced a token. Messages received meanwhile go to pending.
+    """
+    task = asyncio.create_task(coro)
+    watcher = asyncio.create_task(websocket.receive())
+    try:
+        while True:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if task.done():
+                return task.result()
+            message = watcher.result()
+            if message["type"] == "websocket.disconnect":
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+                raise WebSocketDisconnect(message.get("code", 1000))
+            pending.append(message)
+            watcher = asyncio.create_task(websocket.receive())
+    finally:
+        if not task.done():
+            # The caller itself was cancelled
+            task.cancel()
+        if watcher.done() and not watcher.cancelled() and watcher.exception() is None:
+            # Arrived together with the answer; a disconnect is raised by the next receive_text
+            pending.append(watcher.result())
+        watcher.cancel()
+
 @app.websocket("/airesponse")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    connection_id = next(connection_ids)
+    # Messages that arrived while a query was being answered
+    pending = deque()
+    # One conversation per connection unless the client names its own session. Session keys
+    # are tuples in separate namespaces, so no client-supplied id can name a connection's session
+    connection_session = ("connection", connection_id) if per_connection_sessions else None
+    active_websockets.inc()
     try:
         while True:
             try:
                 # Wait for any message (text or JSON)
-                message = await websocket.receive_text()
+                message = await receive_text(websocket, pending)
                 
                 # Try to parse as JSON
                 try:
@@ -170,18 +438,51 @@ async def websocket_endpoint(websocket: WebSocket):
                         })
                         continue
                     query_text = message_data['content']
+                    stream = bool(message_data.get('stream', False))
+                    session_id = ("client", str(message_data['session_id'])) if message_data.get('session_id') \
+                        else connection_session
                 except json.JSONDecodeError:
                     # If not JSON, treat the message as plain text query
                     query_text = message
+                    stream = False
+                    session_id = connection_session
                 
                 print(f"\nUser: {query_text}")  # Print user's query
                 
+                if stream:
+                    # Streaming clients get tokens as they arrive, no thinking messages needed
+                    async def send_token(token):
+                        await websocket.send_json({
+                            "type": "token",
+                            "data": {
+                                "token": token
+                            }
+                        })
+                    
+                    try:
+                        result = await until_disconnect(websocket, answer_query(
+                            query_text, on_token=send_token, connection_id=connection_id, session_id=session_id
+                        ), pending)
+                        print(f"Assistant: {result['answer']}\n")
+                        await websocket.send_json({
+                            "type": "answer",
+                            "data": result
+                        })
+                    except WebSocketDisconnect:
+                        raise
+                    except Exception as e:
+                        print(f"Error: {str(e)}")
+                        await websocket.send_json(error_frame(e))
+                    continue
+                
                 # Start sending thinking messages immediately after receiving the query
                 thinking_task = asyncio.create_task(send_thinking_messages(websocket))
                 
                 # Process the query
                 try:
-                    result = await process_query(query_text)
+                    result = await until_disconnect(websocket, answer_query(
+                        query_text, connection_id=connection_id, session_id=session_id
+                    ), pending)
                     
                     # Cancel thinking messages before sending the response
                     thinking_task.cancel()
@@ -196,6 +497,9 @@ async def websocket_endpoint(websocket: WebSocket):
                         "type": "answer",
                         "data": result
                     })
+                except WebSocketDisconnect:
+                    thinking_task.cancel()
+                    raise
                 except Exception as e:
                     # Cancel thinking messages before sending error
                     print("\nCancelling thinking messages due to error...")  # Debug print
@@ -205,14 +509,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     except asyncio.CancelledError:
                         pass
                     
-                    error_msg = str(e)
-                    print(f"Error: {error_msg}")
-                    await websocket.send_json({
-                        "type": "error",
-                        "data": {
-                            "message": error_msg
-                        }
-                    })
+                    print(f"Error: {str(e)}")
+                    await websocket.send_json(error_frame(e))
 
             except WebSocketDisconnect:
                 print("Client disconnected")
@@ -240,11 +538,37 @@ async def websocket_endpoint(websocket: WebSocket):
             })
         except:
             pass
+    finally:
+        # Client-named sessions outlive the connection until their TTL
+        if connection_session is not None:
+            sessions.discard(connection_session)
+        active_websockets.dec()
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "message": "API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def stats():
+    return {
+        "query_cache": query_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "sessions": sessions.stats(),
+        "scheduler": scheduler.stats()
+    }
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8100) 
\ No newline at end of file
+    # With several workers each process attaches to the same memory-mapped vault snapshot
+    server = config.get("server", {})
+    uvicorn.run(
+        "rag_api:app",
+        host=server.get("host", "127.0.0.1"),
+        port=server.get("port", 8100),
+        workers=server.get("workers", 1)
+    ) 
\ No newline at end of file
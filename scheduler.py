@@ -0,0 +1,114 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class SchedulerBusy(Exception):
+    """Raised when the request queue is full; carries the estimated wait in seconds"""
+
+    def __init__(self, estimated_wait: float):
+        super().__init__(f"Server busy, estimated wait {estimated_wait:.1f}s")
+        self.estimated_wait = estimated_wait
+
+
+class RequestScheduler:
+    """Admission control for query processing.
+
+    At most `max_concurrent` requests run at once. Up to `max_queue` more
+    wait, each connection in its own FIFO, and freed slots are handed out
+    round-robin across connections so one chatty kiosk cannot starve the
+    others. Beyond that, acquire() fails fast with SchedulerBusy.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, initial_service_time: float = 5.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.rejected = 0
+        # Exponentially weighted mean request duration, used for wait estimates
+        self.service_time = initial_service_time
+        self._waiting = OrderedDict()
+        self._queued = 0
+
+    @classmethod
+    def from_config(cls, scheduler_config):
+        scheduler_config = scheduler_config or {}
+        return cls(scheduler_config.get("max_concurrent", 4), scheduler_config.get("max_queue", 32))
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def estimated_wait(self, position: int = None) -> float:
+        """Seconds until a request at `position` in the queue (default: the end) starts"""
+        if position is None:
+            position = self._queued
+        return self.service_time * (position // self.max_concurrent + 1)
+
+    def _dispatch(self):
+        """Hand free slots to waiting requests, round-robin over connections"""
+        while self.active < self.max_concurrent and self._waiting:
+            connection_id, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            self._queued -= 1
+            # Rotate this connection to the back of the ring
+            del self._waiting[connection_id]
+            if waiters:
+                self._waiting[connection_id] = waiters
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self, connection_id):
+        if self.active < self.max_concurrent and not self._waiting:
+            self.active += 1
+            return
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusy(self.estimated_wait())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(connection_id, deque()).append(future)
+        self._queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before cancellation, give it back
+                self.release()
+            else:
+                waiters = self._waiting.get(connection_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    self._queued -= 1
+                    if not waiters:
+                        del self._waiting[connection_id]
+            raise
+
+    def release(self, duration: float = None):
+        self.active -= 1
+        if duration is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * duration
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, connection_id):
+        """Hold one processing slot for the duration of the block"""
+        await self.acquire(connection_id)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start_time)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "estimated_wait_s": round(self.estimated_wait(), 2),
+        }
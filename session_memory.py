@@ -0,0 +1,141 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict, deque
+
+
+class _Session:
+    __slots__ = ("messages", "last_access", "generation")
+
+    def __init__(self, max_messages: int, now: float, generation: int):
+        self.messages = deque(maxlen=max_messages)
+        self.last_access = now
+        # Tells this session's heap entries from those of an earlier session with the same id
+        self.generation = generation
+
+
+class SessionStore:
+    """Bounded conversation histories for /airesponse sessions.
+
+    Each session keeps its last `max_messages` messages, each truncated to
+    `max_message_chars`, and at most `max_sessions` sessions are kept,
+    least recently used first out, so memory stays bounded however many
+    kiosks connect. Idle sessions expire after `ttl_seconds`: a heap holds
+    one deadline per session, and a single loop timer fires at the earliest
+    one instead of polling. Heap entries hold only the session id, so a
+    dropped session's messages are freed at once.
+    """
+
+    def __init__(self, max_sessions: int = 10000, max_messages: int = 10,
+                 max_message_chars: int = 2000, ttl_seconds: float = 900):
+        self.max_sessions = max(1, max_sessions)
+        self.max_messages = max(1, max_messages)
+        self.max_message_chars = max_message_chars
+        self.ttl_seconds = ttl_seconds
+        self.expired = 0
+        self.evicted = 0
+        self._sessions = OrderedDict()
+        self._deadlines = []
+        self._generations = itertools.count()
+        self._timer = None
+
+    @classmethod
+    def from_config(cls, sessions_config):
+        sessions_config = sessions_config or {}
+        return cls(
+            sessions_config.get("max_sessions", 10000),
+            sessions_config.get("max_messages", 10),
+            sessions_config.get("max_message_chars", 2000),
+            sessions_config.get("ttl_seconds", 900),
+        )
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _live(self, session_id, now: float):
+        """The session if it exists and has not gone idle past its TTL"""
+        session = self._sessions.get(session_id)
+        if session is not None and now - session.last_access >= self.ttl_seconds:
+            del self._sessions[session_id]
+            self.expired += 1
+            return None
+        return session
+
+    def history(self, session_id) -> list[dict]:
+        """The session's messages as chat messages, oldest first (empty for unknown sessions)"""
+        session = self._live(session_id, time.monotonic())
+        if session is None:
+            return []
+        return list(session.messages)
+
+    def append(self, session_id, role: str, content: str):
+        """Add a message, creating the session and evicting the least recently used one if needed"""
+        now = time.monotonic()
+        session = self._live(session_id, now)
+        if session is None:
+            session = self._sessions[session_id] = _Session(self.max_messages, now, next(self._generations))
+            self._push_deadline(session_id, session, now + self.ttl_seconds)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            self._schedule()
+        else:
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+        session.messages.append({"role": role, "content": content[:self.max_message_chars]})
+
+    def discard(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    def _current(self, session_id, generation: int):
+        """The session a heap entry refers to, or None if it was dropped since"""
+        session = self._sessions.get(session_id)
+        if session is None or session.generation != generation:
+            return None
+        return session
+
+    def _push_deadline(self, session_id, session, deadline: float):
+        heapq.heappush(self._deadlines, (deadline, session.generation, session_id))
+        if len(self._deadlines) > 2 * len(self._sessions) + 1024:
+            # Entries of discarded and evicted sessions pile up under connection churn
+            self._deadlines = [entry for entry in self._deadlines if self._current(entry[2], entry[1])]
+            heapq.heapify(self._deadlines)
+
+    def _schedule(self):
+        """Arm the loop timer for the earliest deadline, if none is armed"""
+        if self._timer is not None or not self._deadlines:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside an event loop idle sessions are still dropped on access
+            return
+        delay = max(0.0, self._deadlines[0][0] - time.monotonic())
+        self._timer = loop.call_later(delay, self._expire)
+
+    def _expire(self):
+        """Drop sessions whose deadline passed; deadlines of touched sessions are pushed back"""
+        self._timer = None
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, generation, session_id = heapq.heappop(self._deadlines)
+            session = self._current(session_id, generation)
+            if session is None:
+                # Evicted, discarded or expired on access since the deadline was pushed
+                continue
+            deadline = session.last_access + self.ttl_seconds
+            if deadline <= now:
+                del self._sessions[session_id]
+                self.expired += 1
+            else:
+                self._push_deadline(session_id, session, deadline)
+        self._schedule()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
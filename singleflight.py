@@ -0,0 +1,108 @@
+import asyncio
+
+# Marks the end of a flight's token stream
+_DONE = object()
+
+
+class _Flight:
+    """One in-progress computation, its result future and its token broadcast"""
+
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+        # Callers still waiting for the result; the task is cancelled when none are left
+        self.waiters = 0
+        self.tokens = []
+        self.subscribers = []
+        self.done = False
+
+    async def broadcast(self, token):
+        self.tokens.append(token)
+        for queue in self.subscribers:
+            queue.put_nowait(token)
+
+    def finish(self):
+        self.done = True
+        for queue in self.subscribers:
+            queue.put_nowait(_DONE)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue that replays tokens broadcast so far, then follows new ones"""
+        queue = asyncio.Queue()
+        for token in self.tokens:
+            queue.put_nowait(token)
+        if self.done:
+            queue.put_nowait(_DONE)
+        else:
+            self.subscribers.append(queue)
+        return queue
+
+
+class SingleFlight:
+    """Coalesces identical concurrent requests into one computation.
+
+    The first request for a key starts `fn(broadcast)` as a task; later
+    requests for the same key while it runs attach to it instead of starting
+    new work. Every caller gets the result, and callers passing on_token also
+    receive every streamed token, including those produced before they joined.
+    The work is cancelled once every caller waiting on it has gone away.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def _forget(self, key, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _lead(self, key, flight: _Flight, fn):
+        try:
+            flight.future.set_result(await fn(flight.broadcast))
+        except Exception as e:
+            flight.future.set_exception(e)
+        finally:
+            # Cancelled (or failed with a BaseException): attached callers must not wait forever
+            if not flight.future.done():
+                flight.future.cancel()
+            self._forget(key, flight)
+            flight.finish()
+
+    async def run(self, key, fn, on_token=None):
+        """Return (result, coalesced) for key, running fn only if no identical call is in flight"""
+        flight = self._flights.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            flight = _Flight()
+            self._flights[key] = flight
+            self.started += 1
+            flight.task = asyncio.create_task(self._lead(key, flight, fn))
+
+        flight.waiters += 1
+        try:
+            if on_token is not None:
+                queue = flight.subscribe()
+                while True:
+                    token = await queue.get()
+                    if token is _DONE:
+                        break
+                    await on_token(token)
+
+            # Shield so a caller going away does not cancel work others are waiting on
+            return await asyncio.shield(flight.future), coalesced
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.future.done():
+                # Nobody is left to receive the result; later callers start afresh
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -2,6 +2,24 @@ import re
 import unicodedata
 import codecs
 
+# Common Spanish function words, accent-folded, ignored by lexical search
+SPANISH_STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuales cuando de del desde donde
+durante e el ella ellas ellos en entre era eran es esa esas ese eso esos esta estan estas
+este esto estos fue fueron ha han hasta hay la las le les lo los mas me mi mis muy nada ni
+no nos nosotros o os otra otras otro otros para pero poco por porque que quien quienes se
+sea ser si sin sobre son su sus tambien te tiene tienen todo todos tu tus un una unas uno
+unos y ya yo
+""".split())
+
+# Derivational suffixes replaced by the light stemmer before plurals are handled
+_STEM_DERIVATIONAL = (("aciones", "acion"), ("uciones", "ucion"), ("idades", "idad"), ("mente", ""))
+
+_VOWELS = frozenset("aeiou")
+
+# Bump when stem_spanish_word changes, so indexes of stemmed tokens are rebuilt
+STEMMER_VERSION = 2
+
 def clean_spanish_text(text):
     """
     Clean and normalize Spanish text.
@@ -76,4 +94,50 @@ def split_spanish_sentences(text):
     # Clean up each sentence and ensure UTF-8 BOM
     sentences = [s.strip().encode('utf-8-sig').decode('utf-8-sig') for s in sentences if s.strip()]
     
-    return sentences 
\ No newline at end of file
+    return sentences 
+
+def fold_accents(text):
+    """
+    Lowercase and strip diacritics (á -> a, ñ -> n) for accent-insensitive matching.
+    """
+    text = unicodedata.normalize('NFD', text.lower())
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+
+def stem_spanish_word(word):
+    """
+    Light Spanish stemmer: strips plural, gender and adverb suffixes only,
+    so singular and plural forms share a stem. Expects accent-folded words.
+
+    >>> [stem_spanish_word(w) for w in ("medicas", "medico", "medicos")]
+    ['medic', 'medic', 'medic']
+    >>> [stem_spanish_word(w) for w in ("pacientes", "paciente", "clases", "clase")]
+    ['pacient', 'pacient', 'clas', 'clas']
+    >>> [stem_spanish_word(w) for w in ("luces", "luz", "veces", "vez")]
+    ['luz', 'luz', 'vez', 'vez']
+    >>> [stem_spanish_word(w) for w in ("doctores", "doctor", "ciudades", "ciudad")]
+    ['doctor', 'doctor', 'ciudad', 'ciudad']
+    """
+    for suffix, replacement in _STEM_DERIVATIONAL:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)] + replacement
+            break
+    
+    # Plurals: -ces -> -z (luces), -es after a consonant (doctores), -s after a vowel (casas)
+    if word.endswith("ces") and len(word) >= 5:
+        word = word[:-3] + "z"
+    elif word.endswith("es") and len(word) >= 5 and word[-3] not in _VOWELS:
+        word = word[:-2]
+    elif word.endswith("s") and len(word) >= 4 and word[-2] in _VOWELS:
+        word = word[:-1]
+    
+    # Gender and the -e of singulars whose plural takes -s (paciente, pacientes)
+    if word[-1:] in ("a", "e", "o") and len(word) >= 4:
+        word = word[:-1]
+    return word
+
+def tokenize_spanish(text):
+    """
+    Split text into accent-folded, stemmed tokens without stopwords.
+    """
+    words = re.findall(r'\w+', fold_accents(text))
+    return [stem_spanish_word(w) for w in words if w not in SPANISH_STOPWORDS]
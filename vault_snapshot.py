@@ -0,0 +1,368 @@
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+import shutil
+from typing import NamedTuple, Optional
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+import numpy as np
+
+from ann_index import IVFIndex, load_or_build_index
+from lexical_index import BM25Index, load_or_build_lexical_index, uses_lexical
+from context_packer import estimate_token_counts
+from embedding_store import chunk_key, keys_fingerprint
+from quantization import QuantizedVectors, load_or_build_quantized
+from projection import Projection, project_matrix
+from text.spanish import STEMMER_VERSION
+
+
+class VaultSnapshot(NamedTuple):
+    """Immutable in-memory view of the vault: chunks, their embeddings and indexes.
+
+    Queries grab one snapshot reference and use it throughout, so a reload
+    swapping in a new snapshot never mixes chunks and rows of two versions.
+    """
+    chunks: object
+    matrix: np.ndarray
+    index: Optional[object]
+    lexical: Optional[object]
+    version: str
+    file_stat: tuple
+    token_counts: np.ndarray
+    quantized: Optional[object]
+    projection: Optional[object]
+
+
+class MappedChunks:
+    """Read-only sequence of chunk texts backed by a memory-mapped UTF-8 blob.
+
+    Chunk i is data[offsets[i]:offsets[i + 1]], decoded on access, so every
+    worker process shares the same page-cache pages instead of a private copy.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def read_vault(path: str) -> list[str]:
+    """Load the processed documents from the vault file, one chunk per line"""
+    if not os.path.exists(path):
+        return []
+
+    with codecs.open(path, "r", encoding="utf-8-sig") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def vault_file_stat(path: str) -> tuple:
+    """(mtime_ns, size) of the vault file, used to detect changes cheaply"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _snapshot_dir(config) -> str:
+    return config.get("snapshot_dir", "vault_snapshots")
+
+
+def _manifest_path(config) -> str:
+    return os.path.join(_snapshot_dir(config), "current.json")
+
+
+def read_manifest(config) -> Optional[dict]:
+    """The published snapshot's manifest, or None if nothing was published yet"""
+    try:
+        with open(_manifest_path(config), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def _map_array(path: str) -> np.ndarray:
+    """Memory-map a .npy file read-only; empty arrays cannot be mapped and are loaded instead"""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+def _save_arrays(version_dir: str, name: str, arrays: dict, meta: dict):
+    """Write a structure as one .npy file per array plus a small JSON header"""
+    arrays = {key: array for key, array in arrays.items() if array is not None}
+    for key, array in arrays.items():
+        _save_array(os.path.join(version_dir, f"{name}.{key}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(version_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump({**meta, "arrays": sorted(arrays)}, f)
+
+
+def _map_arrays(version_dir: str, name: str):
+    """Memory-map a structure written by _save_arrays; returns (arrays, meta), or None if absent"""
+    try:
+        with open(os.path.join(version_dir, f"{name}.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    return {key: _map_array(os.path.join(version_dir, f"{name}.{key}.npy")) for key in meta["arrays"]}, meta
+
+
+def _chars_per_token(config) -> float:
+    return config.get("context", {}).get("chars_per_token", 3.5)
+
+
+def snapshot_settings(config) -> str:
+    """Hash of the settings that shape a snapshot's files; changing one republishes the vault"""
+    index_config = config.get("index", {})
+    settings = {
+        "index": [index_config.get(key) for key in ("type", "nlist", "min_vectors")],
+        "quantization": config.get("quantization", {}).get("type", "none"),
+        "projection": [config.get("projection", {}).get(key) for key in ("type", "dim")],
+        # Whether the snapshot needs a BM25 index (retrieval.mode, lexical_fast_path)
+        "lexical": uses_lexical(config),
+        "chars_per_token": _chars_per_token(config),
+        "stemmer": STEMMER_VERSION,
+        # Bump when the layout of a version directory changes
+        "layout": 2,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def publish_snapshot(config, store, embed_fn) -> dict:
+    """Build the vault snapshot files and point the manifest at them (blocking).
+
+    Each version lives in its own directory under snapshot_dir, so workers
+    still mapping the previous version are never affected by the write.
+    """
+    path = config["vault_file"]
+    # Stat before reading so a write racing with the read triggers another reload
+    file_stat = vault_file_stat(path)
+    chunks = read_vault(path)
+    matrix = store.get_matrix(chunks, embed_fn)
+    # From the chunks themselves: the store keeps its last matrix when the vault is emptied
+    vault_fingerprint = keys_fingerprint([chunk_key(chunk, store.model) for chunk in chunks])
+    settings = snapshot_settings(config)
+    version = hashlib.sha256(f"{vault_fingerprint}:{settings}".encode("ascii")).hexdigest()[:16]
+
+    version_dir = os.path.join(_snapshot_dir(config), version)
+    if not os.path.exists(os.path.join(version_dir, "matrix.npy")):
+        os.makedirs(version_dir, exist_ok=True)
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        _save_array(os.path.join(version_dir, "chunks.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        _save_array(os.path.join(version_dir, "offsets.npy"), offsets)
+        _save_array(os.path.join(version_dir, "tokens.npy"),
+                    estimate_token_counts(chunks, _chars_per_token(config)))
+        if chunks:
+            # The store keeps full vectors; the snapshot holds them projected if configured
+            projection, matrix, fingerprint = project_matrix(config, matrix, vault_fingerprint)
+            # Every array is its own .npy file so workers map them instead of loading copies
+            if projection is not None:
+                _save_arrays(version_dir, "projection",
+                             {"mean": projection.mean, "components": projection.components},
+                             {"kind": projection.kind, "dim": projection.dim, "fingerprint": projection.fingerprint})
+            index = load_or_build_index(config, matrix, fingerprint)
+            if index is not None:
+                _save_arrays(version_dir, "index", {"centroids": index.centroids, "offsets": index.offsets,
+                                                    "ids": index.ids}, {"fingerprint": index.fingerprint})
+            lexical = load_or_build_lexical_index(config, chunks, vault_fingerprint)
+            if lexical is not None:
+                _save_arrays(version_dir, "lexical", lexical.arrays(), {"fingerprint": lexical.fingerprint})
+            quantized = load_or_build_quantized(config, matrix, fingerprint)
+            if quantized is not None:
+                _save_arrays(version_dir, "quantized", {"codes": quantized.codes, "scales": quantized.scales},
+                             {"kind": quantized.kind, "dim": quantized.dim, "fingerprint": quantized.fingerprint})
+        # Written last: its presence marks the version directory as complete
+        tmp_path = os.path.join(version_dir, "matrix.npy.tmp")
+        _save_array(tmp_path, np.ascontiguousarray(matrix))
+        os.replace(tmp_path, os.path.join(version_dir, "matrix.npy"))
+
+    previous = read_manifest(config)
+    manifest = {"version": version, "file_stat": list(file_stat), "chunks": len(chunks), "settings": settings}
+    tmp_path = _manifest_path(config) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, _manifest_path(config))
+
+    # Keep the previous version for workers that have not swapped yet
+    _remove_old_versions(config, keep={version, previous["version"] if previous else version})
+    return manifest
+
+
+def _remove_old_versions(config, keep: set):
+    """Delete version directories other than `keep`"""
+    root = _snapshot_dir(config)
+    for name in os.listdir(root):
+        version_dir = os.path.join(root, name)
+        if name in keep or not os.path.isdir(version_dir):
+            continue
+        # Files still mapped by a lagging worker cannot be removed on Windows; retry next time
+        shutil.rmtree(version_dir, ignore_errors=True)
+
+
+def attach_snapshot(config, manifest: dict) -> VaultSnapshot:
+    """Map a published snapshot read-only"""
+    version = manifest["version"]
+    version_dir = os.path.join(_snapshot_dir(config), version)
+    retrieval = config.get("retrieval", {})
+    chunks = MappedChunks(_map_array(os.path.join(version_dir, "chunks.npy")),
+                          _map_array(os.path.join(version_dir, "offsets.npy")))
+    tokens_path = os.path.join(version_dir, "tokens.npy")
+    if os.path.exists(tokens_path):
+        token_counts = _map_array(tokens_path)
+    else:
+        # Published before token estimates were cached
+        token_counts = estimate_token_counts(chunks, _chars_per_token(config))
+    index = lexical = quantized = projection = None
+    mapped = _map_arrays(version_dir, "index")
+    if mapped is not None:
+        arrays, meta = mapped
+        index = IVFIndex(arrays["centroids"], arrays["offsets"], arrays["ids"], meta["fingerprint"])
+    mapped = _map_arrays(version_dir, "lexical")
+    if mapped is not None:
+        arrays, meta = mapped
+        lexical = BM25Index(arrays["terms"], arrays["offsets"], arrays["doc_ids"], arrays["term_freqs"],
+                            arrays["doc_lengths"], meta["fingerprint"],
+                            retrieval.get("bm25_k1", 1.2), retrieval.get("bm25_b", 0.75))
+    mapped = _map_arrays(version_dir, "quantized")
+    if mapped is not None:
+        arrays, meta = mapped
+        quantized = QuantizedVectors(meta["kind"], arrays["codes"], meta["dim"], arrays.get("scales"),
+                                     meta["fingerprint"])
+    mapped = _map_arrays(version_dir, "projection")
+    if mapped is not None:
+        arrays, meta = mapped
+        projection = Projection(meta["kind"], meta["dim"], arrays.get("mean"), arrays.get("components"),
+                                meta["fingerprint"])
+    return VaultSnapshot(chunks, _map_array(os.path.join(version_dir, "matrix.npy")), index, lexical, version,
+                         tuple(manifest["file_stat"]), token_counts, quantized, projection)
+
+
+class PublishLock:
+    """Cross-process lock electing the single worker that (re)builds the snapshot.
+
+    An OS lock on an open handle, so it is held for as long as the publish
+    takes and released by the OS if the publisher crashes; no staleness
+    guess can hand it to a second worker mid-publish.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self) -> bool:
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        try:
+            if os.name == "nt":
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            if os.name == "nt":
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            # Closing the handle releases the lock in any case
+            os.close(fd)
+
+
+class VaultWatcher:
+    """Keeps this worker's current VaultSnapshot in sync with the vault file.
+
+    Every worker polls the vault file and the snapshot manifest. When the
+    vault changes, the one worker holding the publish lock builds a new
+    snapshot version; all workers then see the new manifest and swap to
+    the new version together.
+    """
+
+    def __init__(self, config, store, embed_fn):
+        self.config = config
+        self.store = store
+        self.embed_fn = embed_fn
+        self.interval = config.get("vault_reload_interval", 5)
+        self.snapshot = None
+        self._task = None
+        self._settings = snapshot_settings(config)
+        os.makedirs(_snapshot_dir(config), exist_ok=True)
+        self._lock = PublishLock(os.path.join(_snapshot_dir(config), "publish.lock"))
+
+    async def _publish_if_stale(self, manifest):
+        """Publish a new snapshot if the vault or its settings changed and no other worker is doing it"""
+        if manifest is not None and tuple(manifest["file_stat"]) == vault_file_stat(self.config["vault_file"]) \
+                and manifest.get("settings") == self._settings:
+            return manifest
+        if not self._lock.acquire():
+            return manifest
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, publish_snapshot, self.config, self.store, self.embed_fn)
+        finally:
+            self._lock.release()
+
+    async def _sync(self) -> bool:
+        """Publish if needed and attach the current version; True if the snapshot changed"""
+        manifest = await self._publish_if_stale(read_manifest(self.config))
+        if manifest is None or (self.snapshot is not None and manifest["version"] == self.snapshot.version
+                                and tuple(manifest["file_stat"]) == self.snapshot.file_stat):
+            return False
+        # Single reference assignment: in-flight queries keep the old snapshot
+        loop = asyncio.get_running_loop()
+        self.snapshot = await loop.run_in_executor(None, attach_snapshot, self.config, manifest)
+        return True
+
+    async def start(self):
+        """Attach the published snapshot (publishing or waiting for it first) and start polling"""
+        while not await self._sync() and self.snapshot is None:
+            # Another worker is publishing the first snapshot
+            await asyncio.sleep(0.5)
+        print(f"Loaded {len(self.snapshot.chunks)} chunks from {self.config['vault_file']}")
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await self._sync():
+                    print(f"Reloaded vault: {len(self.snapshot.chunks)} chunks (version {self.snapshot.version})")
+            except Exception as e:
+                print(f"Error reloading vault, keeping previous snapshot: {str(e)}")
@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int):
+    """Exact cosine top-k over a matrix of L2-normalized rows.
+
+    Returns (indices, scores) sorted by descending score. One matrix-vector
+    product plus argpartition keeps the work in BLAS instead of Python loops.
+    """
+    n = matrix.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    scores = matrix @ np.asarray(query, dtype=np.float32)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    order = np.argsort(-scores[candidates], kind="stable")
+    indices = candidates[order]
+    return indices, scores[indices]